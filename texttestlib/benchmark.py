@@ -0,0 +1,339 @@
+
+""" Benchmarks for TextTest's own per-test overhead.
+
+Generates a synthetic test tree of configurable size, with result files that need
+run-dependent text and floating point filtering, and times the framework's hot paths
+on it: test discovery, config lookups, filtering, comparison, teststate pickling,
+historical HTML generation and a full run through the local queue system.
+Results are written as JSON, so they can be stored and compared between revisions.
+
+Run as "python -m texttestlib.benchmark --help" for the available options. """
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import logging
+import platform
+import tempfile
+import subprocess
+from collections import OrderedDict
+from optparse import OptionParser
+from pickle import Pickler
+from texttestlib import plugins, texttest_version
+
+appName = "bench"
+allStages = ["discovery", "config", "filtering", "comparison", "pickling", "html", "queuesystem"]
+
+configText = """# Synthetic application generated by texttestlib.benchmark
+executable:${TEXTTEST_ROOT}/program.py
+interpreter:python3
+default_texttest_tmp:${TEXTTEST_ROOT}/../texttesttmp
+batch_result_repository:${TEXTTEST_ROOT}/../repository
+historical_report_location:${TEXTTEST_ROOT}/../report
+
+[run_dependent_text]
+output:[0-9][0-9]:[0-9][0-9]:[0-9][0-9]{REPLACE <time>}
+output:Run on host
+output:Temporary files{->}End of temporary files
+[end]
+
+[floating_point_tolerance]
+output:0.0001
+[end]
+"""
+
+programText = """#!/usr/bin/env python3
+import sys
+sys.path.insert(0, %r)
+from texttestlib.benchmark import makeOutputLines
+sys.stdout.writelines(makeOutputLines(int(sys.argv[1]), int(sys.argv[2]), perturb=True))
+"""
+
+# Keys that are looked up for every test during a normal run
+lookupKeys = [("binary_file", None), ("lines_of_text_difference", None), ("max_width_text_difference", None),
+              ("text_diff_program", None), ("home_operating_system", None), ("suppress_stderr_text", None),
+              ("run_dependent_text", "output"), ("unordered_text", "output"),
+              ("floating_point_tolerance", "output"), ("relative_float_tolerance", "output"),
+              ("failure_severity", "output"), ("failure_display_priority", "output"),
+              ("collate_file", "output"), ("performance_test_minimum", "cputime")]
+
+
+def makeOutputLines(seed, lineCount, perturb=False):
+    rand = random.Random(seed)
+    noise = random.Random()
+    stamp = time.strftime("%H:%M:%S") if perturb else "08:00:00"
+    lines = ["Run on host " + (plugins.gethostname() if perturb else "reference") + "\n",
+             "Temporary files\n", "/tmp/bench_" + str(noise.random()) + "\n", "End of temporary files\n"]
+    for lineNumber in range(lineCount):
+        value = rand.uniform(0, 1000)
+        if perturb:
+            value += noise.uniform(-1e-5, 1e-5)
+        lines.append(stamp + " Processed item " + str(lineNumber) + " of " + str(lineCount) +
+                     " : cost " + "%.6f" % value + "\n")
+    return lines
+
+
+class SyntheticTree:
+    def __init__(self, rootDir, testCount, suiteSize, lineCount):
+        self.rootDir = rootDir
+        self.testCount = testCount
+        self.suiteSize = suiteSize
+        self.lineCount = lineCount
+        self.appDir = os.path.join(rootDir, "tests")
+
+    def create(self):
+        plugins.ensureDirectoryExists(self.appDir)
+        self.writeFile(os.path.join(self.appDir, "config." + appName), configText)
+        programFile = os.path.join(self.appDir, "program.py")
+        self.writeFile(programFile, programText % os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        os.chmod(programFile, 0o755)
+        suiteNames = []
+        for testIndex in range(self.testCount):
+            suiteName = "Suite" + str(testIndex // self.suiteSize).zfill(4)
+            testName = "Test" + str(testIndex).zfill(6)
+            if suiteName not in suiteNames:
+                suiteNames.append(suiteName)
+                self.appendLine(os.path.join(self.appDir, "testsuite." + appName), suiteName)
+            suiteDir = os.path.join(self.appDir, suiteName)
+            self.appendLine(os.path.join(suiteDir, "testsuite." + appName), testName)
+            testDir = os.path.join(suiteDir, testName)
+            self.writeFile(os.path.join(testDir, "options." + appName), str(testIndex) + " " + str(self.lineCount))
+            self.writeFile(os.path.join(testDir, "output." + appName),
+                           "".join(makeOutputLines(testIndex, self.lineCount)))
+            self.writeFile(os.path.join(testDir, "errors." + appName), "")
+
+    def writeFile(self, fileName, text):
+        with plugins.openForWrite(fileName) as f:
+            f.write(text)
+
+    def appendLine(self, fileName, line):
+        plugins.ensureDirectoryExists(os.path.dirname(fileName))
+        with open(fileName, "a") as f:
+            f.write(line + "\n")
+
+
+class BenchmarkRunner:
+    def __init__(self, tree, stages, repeat, runCount, texttestProgram):
+        self.tree = tree
+        self.stages = stages
+        self.repeat = repeat
+        self.runCount = runCount
+        self.texttestProgram = texttestProgram
+        self.app = None
+        self.tests = []
+        self.results = OrderedDict()
+        self.diag = logging.getLogger("Benchmark")
+
+    def run(self):
+        os.environ["TEXTTEST_PERSONAL_CONFIG"] = os.path.join(self.tree.rootDir, "personal")
+        os.environ["TEXTTEST_TMP"] = os.path.join(self.tree.rootDir, "texttesttmp")
+        plugins.configureLogging()
+        self.loadTests()
+        for stage in self.stages:
+            method = getattr(self, "benchmark" + stage.capitalize())
+            # Stages return None for runs that failed, which mustn't be reported as timings
+            timings = [timing for timing in (method() for _ in range(self.repeat)) if timing is not None]
+            if timings:
+                self.results[stage] = self.summarise(timings)
+                self.diag.info("Stage " + stage + " took " + repr(timings))
+            else:
+                self.results[stage] = OrderedDict([("error", "all " + str(self.repeat) + " runs failed")])
+        return self.results
+
+    def summarise(self, timings):
+        bestTime = min(timings)
+        return OrderedDict([("seconds", timings), ("best", bestTime), ("median", plugins.median(timings)),
+                            ("best_per_test_ms", 1000.0 * bestTime / self.tree.testCount)])
+
+    def loadTests(self):
+        from texttestlib import testmodel
+        oldArgv = sys.argv
+        sys.argv = ["texttest", "-d", self.tree.appDir, "-a", appName, "-con"]
+        try:
+            self.optionFinder = testmodel.OptionFinder()
+        finally:
+            sys.argv = oldArgv
+        self.app = testmodel.Application(appName, testmodel.DirectoryCache(self.tree.appDir), [], self.optionFinder)
+        suite = self.app.createInitialTestSuite([])
+        suite.readContents()
+        self.tests = suite.testCaseList()
+        for test in self.tests:
+            test.makeWriteDirectory()
+            with open(test.getFileName("options")) as f:
+                seed, lineCount = list(map(int, f.read().split()))
+            with open(test.makeTmpFileName("output"), "w") as f:
+                f.writelines(makeOutputLines(seed, lineCount, perturb=True))
+            open(test.makeTmpFileName("errors"), "w").close()
+
+    def timeCall(self, method, *args):
+        start = time.perf_counter()
+        method(*args)
+        return time.perf_counter() - start
+
+    def benchmarkDiscovery(self):
+        def discover():
+            suite = self.app.createInitialTestSuite([])
+            suite.readContents()
+            suite.testCaseList()
+        return self.timeCall(discover)
+
+    def benchmarkConfig(self):
+        def lookup():
+            for test in self.tests:
+                for key, subKey in lookupKeys:
+                    if subKey is None:
+                        test.getConfigValue(key)
+                    else:
+                        test.getCompositeConfigValue(key, subKey)
+        return self.timeCall(lookup)
+
+    def benchmarkFiltering(self):
+        from texttestlib.default import rundependent
+        actions = [rundependent.FilterOriginal(), rundependent.FilterTemporary()]
+
+        def filterAll():
+            for test in self.tests:
+                for action in actions:
+                    action(test)
+        return self.timeCall(filterAll)
+
+    def benchmarkComparison(self):
+        from texttestlib.default import comparetest
+        if "filtering" not in self.stages:
+            self.benchmarkFiltering()
+        action = comparetest.MakeComparisons()
+
+        def compareAll():
+            for test in self.tests:
+                action(test)
+        return self.timeCall(compareAll)
+
+    def benchmarkPickling(self):
+        if not any(test.state.hasResults() for test in self.tests):
+            self.benchmarkComparison()
+        repository = self.getRepositoryDir()
+
+        def pickleAll():
+            for test in self.tests:
+                testDir = os.path.join(repository, test.getRelPath())
+                plugins.ensureDirectoryExists(testDir)
+                for tag in self.getRunTags():
+                    stateFile = os.path.join(testDir, "teststate_" + tag)
+                    with open(stateFile, "wb") as f:
+                        Pickler(f, protocol=2).dump(test.state)
+                    with open(stateFile, "rb") as f:
+                        plugins.getNewTestStateFromFile(f)
+        return self.timeCall(pickleAll)
+
+    def getRepositoryDir(self):
+        # Kept apart from batch_result_repository, which the queue system round trip writes to
+        return os.path.join(self.tree.rootDir, "history", appName, "default")
+
+    def getRunTags(self):
+        startTime = time.time()
+        return [time.strftime("%d%b%Y", time.localtime(startTime - day * 86400)) + "_bench"
+                for day in range(self.runCount)]
+
+    def benchmarkHtml(self):
+        from texttestlib.default.batch import testoverview
+        if "pickling" not in self.stages or not os.path.isdir(self.getRepositoryDir()):
+            self.benchmarkPickling()
+        pageDir = os.path.join(self.tree.rootDir, "report")
+        # Existing month pages change what gets generated, so always start from scratch
+        if os.path.isdir(pageDir):
+            shutil.rmtree(pageDir)
+        plugins.ensureDirectoryExists(pageDir)
+
+        def getConfigValue(key, subKey="default", allSubKeys=False):
+            if allSubKeys:
+                return self.app.getConfigValue(key)
+            else:
+                return self.app.getCompositeConfigValue(key, subKey)
+        generator = testoverview.GenerateWebPages(getConfigValue, pageDir, getConfigValue("historical_report_resources"),
+                                                  "Benchmark", [], "", [], {})
+        repositoryDirs = OrderedDict([(appName, [("", self.getRepositoryDir())])])
+        return self.timeCall(generator.generate, repositoryDirs, getConfigValue("historical_report_subpages"), False)
+
+    def benchmarkQueuesystem(self):
+        # Full round trip: master process, local queue system slaves, running, filtering, comparing and saving
+        env = os.environ.copy()
+        env["PATH"] = os.path.dirname(sys.executable) + os.pathsep + env.get("PATH", "")
+        cmdArgs = [sys.executable, self.texttestProgram, "-d", self.tree.appDir, "-a", appName,
+                   "-con", "-b", "bench", "-name", "bench" + str(time.time()).replace(".", "")]
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmdArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env)
+        output = proc.communicate()[0]
+        timeTaken = time.perf_counter() - start
+        if proc.returncode:
+            plugins.printWarning("Queue system round trip failed with exit code " + str(proc.returncode) +
+                                 ", leaving it out of the results. Output was:\n" + output.decode(errors="replace"))
+        else:
+            return timeTaken
+
+
+def findTextTestProgram():
+    localProgram = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bin", "texttest")
+    if os.path.isfile(localProgram):
+        return localProgram
+    else:
+        return shutil.which("texttest")
+
+
+def makeParser():
+    parser = OptionParser("usage: python -m texttestlib.benchmark [options]")
+    parser.add_option("-t", "--tests", type="int", default=200, help="number of tests to generate (default 200)")
+    parser.add_option("-s", "--suite-size", type="int", default=20, help="number of tests in each test suite (default 20)")
+    parser.add_option("-l", "--lines", type="int", default=500, help="number of lines in each result file (default 500)")
+    parser.add_option("-r", "--repeat", type="int", default=3, help="number of times to time each stage (default 3)")
+    parser.add_option("-n", "--runs", type="int", default=10,
+                      help="number of historical runs to store for each test for HTML generation (default 10)")
+    parser.add_option("-x", "--stages", default=",".join(allStages),
+                      help="comma-separated stages to run, from " + ",".join(allStages))
+    parser.add_option("-o", "--output", help="write JSON results to this file instead of standard output")
+    parser.add_option("-d", "--directory", help="create the synthetic tree here and keep it afterwards")
+    parser.add_option("-p", "--program", default=findTextTestProgram(),
+                      help="TextTest start script to use for the queue system round trip")
+    return parser
+
+
+def main(args=None):
+    parser = makeParser()
+    options, _ = parser.parse_args(args)
+    stages = [stage.strip() for stage in options.stages.split(",") if stage.strip()]
+    unknownStages = [stage for stage in stages if stage not in allStages]
+    if unknownStages:
+        parser.error("unknown stages " + ",".join(unknownStages) + ": choose from " + ",".join(allStages))
+    if "queuesystem" in stages and not options.program:
+        parser.error("cannot find a TextTest start script for the queue system round trip, please provide --program")
+
+    rootDir = options.directory or tempfile.mkdtemp(prefix="texttest_benchmark_")
+    try:
+        tree = SyntheticTree(os.path.abspath(rootDir), options.tests, options.suite_size, options.lines)
+        tree.create()
+        runner = BenchmarkRunner(tree, stages, options.repeat, options.runs, options.program)
+        results = OrderedDict()
+        results["texttest_version"] = texttest_version.version
+        results["python_version"] = platform.python_version()
+        results["platform"] = platform.platform()
+        results["time"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        results["parameters"] = OrderedDict([("tests", options.tests), ("suite_size", options.suite_size),
+                                             ("lines", options.lines), ("repeat", options.repeat),
+                                             ("runs", options.runs)])
+        results["stages"] = runner.run()
+    finally:
+        if not options.directory:
+            shutil.rmtree(rootDir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
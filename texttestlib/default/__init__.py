@@ -18,6 +18,7 @@ from threading import Thread
 from locale import getpreferredencoding
 # For back-compatibility
 from .runtest import RunTest, Running, Killed
+from .reconnect import ReconnectIndex
 from .batch.externalreport import ExternalFormatResponder, ExternalFormatCollector
 from .database_data import SaveDatabase
 from .scripts import *
@@ -117,6 +118,10 @@ class Config:
                                 possibleValues=["", "site", "personal", "all"])
                 self.addDefaultSwitch(group, "keeptmp", "Keep temporary write-directories")
                 group.addSwitch("ignorefilters", "Ignore all run-dependent text filtering")
+                group.addOption("bench", "Benchmark runs per test", 1, minimum=1, maximum=1000,
+                                description="Run each selected test this many times back-to-back in the same sandbox, and record the minimum, median and standard deviation in the performance files")
+                group.addOption("benchwarmup", "Benchmark warm-up runs", 0, minimum=0, maximum=1000,
+                                description="Run each selected test this many times before the benchmark runs, without measuring performance")
             elif group.name.startswith("Self-diagnostics"):
                 self.addDefaultSwitch(group, "x", "Enable self-diagnostics")
                 defaultDiagDir = plugins.getPersonalDir("log")
@@ -127,6 +132,7 @@ class Config:
                 # Options that don't make sense with the GUI should be invisible there...
                 group.addOption("a", "Load test applications named")
                 group.addOption("s", "Run this script")
+                group.addOption("scriptprocs", "Number of processes to run parallel-safe scripts in (0 means one per CPU)")
                 group.addOption("d", "Look for test files under")
                 group.addSwitch("help", "Print configuration help text on stdout")
                 group.addSwitch("g", "use dynamic GUI")
@@ -472,6 +478,9 @@ class Config:
             not self.isActionReplay() and "coll" not in self.optionMap and not self.optionMap.runScript()
 
     def getThreadActionClasses(self):
+        if self.runningScript() and "scriptprocs" in self.optionMap:
+            from .actionrunner import ParallelScriptRunner
+            return [ParallelScriptRunner]
         from .actionrunner import ActionRunner
         return [ActionRunner]
 
@@ -630,6 +639,8 @@ class Config:
         extractors = app.getConfigValue("performance_logfile_extractor")
         if (perfType and perfType in extractors) or (not perfType and len(extractors) > 0):
             return True
+        elif app.getConfigValue("collect_process_memory") and (not perfType or "mem" in perfType):
+            return True
         else:
             return app.hasAutomaticCputimeChecking()
 
@@ -879,7 +890,10 @@ class Config:
         return sandbox.PrepareWriteDirectory(ignoreCatalogues)
 
     def getTestRunner(self):
-        return RunTest()
+        return RunTest(*self.getBenchmarkCounts())
+
+    def getBenchmarkCounts(self):
+        return self.optionIntValue("bench", 1), self.optionIntValue("benchwarmup", 0)
 
     def getTestEvaluator(self):
         return [self.getFileExtractor(), self.getTemporaryFilterer(), self.getTestComparator(), self.getFailureExplainer()]
@@ -1256,6 +1270,8 @@ class Config:
                              "default": "false"}, "Generate pie chart summary page rather than default HTML tables.")
         app.setConfigDefault("historical_report_split_version", {
                              "default": "false"}, "Split pages per version.")
+        app.setConfigDefault("historical_report_processes", {
+                             "default": 1}, "How many processes to use for reading results and generating the historical report (0 means one per CPU)")
         app.setConfigDefault("batch_sender", {"default": self.getDefaultMailAddress()},
                              "Sender address to use sending mail in batch mode")
         app.setConfigDefault("batch_recipients", {"default": ""},
@@ -1290,6 +1306,8 @@ class Config:
     def setPerformanceDefaults(self, app):
         # Performance values
         app.setConfigDefault("cputime_include_system_time", 0, "Include system time when measuring CPU time?")
+        app.setConfigDefault("collect_process_memory", 0,
+                             "(UNIX) Write the maximum memory used by the SUT process to the 'memory' file, for tests run locally")
         app.setConfigDefault("default_performance_stem", "performance",
                              "Which performance statistic to use when selecting tests by performance, placing performance in Junit XML reports etc")
         app.setConfigDefault("performance_logfile", {"default": []},
@@ -1314,6 +1332,12 @@ class Config:
                              "Name to be used to identify the units in a performance file")
         app.setConfigDefault("performance_ignore_improvements", {
                              "default": "false"}, "Should we ignore all improvements in performance?")
+        app.setConfigDefault("performance_history_samples", {"default": 0},
+                             "How many previous batch results to keep per test in the batch result repository, and compare performance against. 0 compares with the stored file only")
+        app.setConfigDefault("performance_history_threshold", {"default": 3.5},
+                             "How many (robust) standard deviations from the historical median a performance change must be to count as significant")
+        app.setConfigDefault("test_schedule_order", "tree",
+                             "Order to start tests in: 'tree' for test suite order, 'longest_first' to use historical performance data")
         app.setConfigAlias("performance_use_normalised_%", "use_normalised_percentage_change")
         app.setConfigAlias("batch_junit_performance", "default_performance_stem")
 
@@ -1325,6 +1349,8 @@ class Config:
                              "(UNIX) List of machines to run virtual display server (Xvfb) on")
         app.setConfigDefault("virtual_display_count", 1,
                              "(UNIX) Number of virtual display server (Xvfb) instances to run, if enabled")
+        app.setConfigDefault("virtual_display_spare_count", 0,
+                             "(UNIX) Number of extra virtual display servers (Xvfb) to keep running, ready to replace any that terminate")
         app.setConfigDefault("virtual_display_extra_args", "",
                              "(UNIX) Extra arguments (e.g. bitdepth) to supply to virtual display server (Xvfb)")
         app.setConfigDefault("virtual_display_wm_executable", "",
@@ -1517,6 +1543,8 @@ class Config:
                              "Username to use when logging in to bug systems defined in bug_system_location")
         app.setConfigDefault("bug_system_password", {},
                              "Password to use when logging in to bug systems defined in bug_system_location")
+        app.setConfigDefault("bug_system_cache_ttl", {"default": 0},
+                             "How long, in seconds, to keep information fetched from bug systems defined in bug_system_location in a cache shared between runs")
         app.setConfigDefault("batch_jenkins_marked_artefacts", {
                              "default": []}, "Artefacts to highlight in the report when they are updated")
         app.setConfigDefault("batch_jenkins_archive_file_pattern", {
@@ -1732,6 +1760,10 @@ class SaveState(plugins.Responder):
     def notifyComplete(self, test):
         if test.state.isComplete():  # might look weird but this notification also comes in scripts etc.
             test.saveState()
+            ReconnectIndex.recordTest(test)
+
+    def notifyAllComplete(self):
+        ReconnectIndex.writeAll()
 
 
 class OrFilter(plugins.Filter):
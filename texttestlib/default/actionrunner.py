@@ -1,8 +1,12 @@
 
 import sys
+import time
+import heapq
 import logging
 import types
+import multiprocessing
 from texttestlib import plugins
+from .performance import getTestPerformance, getTimeDescription
 from queue import Queue, Empty
 from collections import OrderedDict
 from threading import Lock
@@ -32,16 +36,38 @@ class BaseActionRunner(plugins.Responder, plugins.Observable):
         self.killSignal = None
         self.diag = diag
         self.lockDiag = logging.getLogger("locks")
+        self.scheduler = None
 
     def notifyAdd(self, test, initial):
         if test.classId() == "test-case":
-            self.diag.info("Adding test " + test.uniqueName)
-            self.addTest(test)
+            if self.schedulesByDuration(test):
+                self.diag.info("Scheduling test " + test.uniqueName)
+                if self.scheduler is None:
+                    self.scheduler = DurationScheduler(self.diag)
+                self.scheduler.addTest(test)
+            else:
+                self.diag.info("Adding test " + test.uniqueName)
+                self.addTest(test)
+
+    def schedulesByDuration(self, test):
+        # Only possible while reading, once we've started we have to take tests as they come
+        return (self.scheduler is None or not self.scheduler.started) and \
+            test.getConfigValue("test_schedule_order") == "longest_first"
 
     def addTest(self, test):
         self.testQueue.put(test)
 
+    def getScheduleCapacity(self):
+        return 1
+
+    def addScheduledTests(self):
+        if self.scheduler and not self.scheduler.started:
+            for test in self.scheduler.getOrderedTests(self.getScheduleCapacity()):
+                self.diag.info("Adding scheduled test " + test.uniqueName)
+                self.addTest(test)
+
     def notifyAllRead(self, *args):
+        self.addScheduledTests()
         self.diag.info("All read, adding terminator")
         self.testQueue.put(None)
 
@@ -57,6 +83,8 @@ class BaseActionRunner(plugins.Responder, plugins.Observable):
 
     def notifyAllComplete(self):
         self.allComplete = True
+        if self.scheduler:
+            self.scheduler.reportMakespan()
 
     def notifyKill(self, test):
         self.lock.acquire()
@@ -118,6 +146,72 @@ class BaseActionRunner(plugins.Responder, plugins.Observable):
         return False  # We block, so we shouldn't be the main thread...
 
 
+class DurationScheduler:
+    """ Orders tests longest-first using the historical performance files, so that the
+    longest tests don't end up deciding the total run time by being started last.
+    Tests in the same suite are kept together so that suite set up and tear down still
+    happens exactly once per suite. """
+    def __init__(self, diag):
+        self.diag = diag
+        self.testsByApp = OrderedDict()
+        self.predictedMakespan = 0.0
+        self.startTime = None
+        self.started = False
+
+    def addTest(self, test):
+        self.testsByApp.setdefault(test.app, []).append(test)
+
+    def getOrderedTests(self, capacity):
+        self.started = True
+        self.startTime = time.time()
+        orderedTests, durations = [], []
+        for tests in self.testsByApp.values():
+            appTests, appDurations = self.orderLongestFirst(tests)
+            orderedTests += appTests
+            durations += appDurations
+        self.predictedMakespan = self.predictMakespan(durations, capacity)
+        plugins.log.info("Scheduled " + str(len(orderedTests)) + " tests longest-first, predicted run time " +
+                         getTimeDescription(self.predictedMakespan))
+        return orderedTests
+
+    def orderLongestFirst(self, tests):
+        testDurations = OrderedDict((test, max(getTestPerformance(test), 0.0)) for test in tests)
+        # Total predicted duration and first position in tree order, for each suite and test
+        totals, positions = {}, {}
+        for index, (test, duration) in enumerate(testDurations.items()):
+            for node in self.getPath(test):
+                totals[node] = totals.get(node, 0.0) + duration
+                positions.setdefault(node, index)
+
+        def sortKey(test):
+            return [(-totals[node], positions[node]) for node in self.getPath(test)]
+        orderedTests = sorted(testDurations, key=sortKey)
+        for test in orderedTests:
+            self.diag.info("Predicted duration for " + test.uniqueName + " = " + str(testDurations[test]))
+        return orderedTests, [testDurations[test] for test in orderedTests]
+
+    def getPath(self, test):
+        path = []
+        while test.parent:
+            path.insert(0, test)
+            test = test.parent
+        return path
+
+    def predictMakespan(self, durations, capacity):
+        # Simulate handing out tests in order to whichever slot becomes free first
+        slots = [0.0] * max(1, min(capacity, len(durations)))
+        for duration in durations:
+            heapq.heapreplace(slots, slots[0] + duration)
+        return max(slots)
+
+    def reportMakespan(self):
+        if self.startTime is not None:
+            actualMakespan = time.time() - self.startTime
+            plugins.log.info("Longest-first scheduling: predicted run time " + getTimeDescription(self.predictedMakespan) +
+                             ", actual run time " + getTimeDescription(actualMakespan))
+            self.startTime = None
+
+
 class ActionRunner(BaseActionRunner):
     def __init__(self, optionMap, *args):
         BaseActionRunner.__init__(self, optionMap, logging.getLogger("Action Runner"))
@@ -180,6 +274,86 @@ class ActionRunner(BaseActionRunner):
             appRunner.cleanActions()
 
 
+# Set just before forking the worker processes, so they can find the tests without pickling them
+forkedScriptJobs = []
+
+
+def processForkedScriptJob(index):
+    script, test = forkedScriptJobs[index]
+    try:
+        return True, script.processTest(test)
+    except Exception:
+        # Process it again in the main process, which reports errors in the usual way
+        return False, None
+
+
+class ParallelScriptRunner(ActionRunner):
+    """ Runs scripts that are marked as parallel safe. Their per-test processing is done in a pool of
+    worker processes ahead of time, while everything else, including the output, happens here in test order """
+    def __init__(self, optionMap, *args):
+        ActionRunner.__init__(self, optionMap, *args)
+        processes = int(optionMap.get("scriptprocs") or 0)
+        self.processes = processes if processes > 0 else multiprocessing.cpu_count()
+        self.pool = None
+        self.results = None
+        self.jobTests = set()
+
+    def notifyAllReadAndNotified(self):
+        global forkedScriptJobs
+        jobs = self.findParallelJobs()
+        if len(jobs) > 1 and self.processes > 1 and "fork" in multiprocessing.get_all_start_methods():
+            forkedScriptJobs = jobs
+            self.jobTests = set(test for _, test in jobs)
+            processes = min(self.processes, len(jobs))
+            plugins.log.info("Running script in " + str(processes) + " processes")
+            self.pool = multiprocessing.get_context("fork").Pool(processes)
+            chunksize = max(1, min(100, len(jobs) // (processes * 4)))
+            jobResults = self.pool.imap(processForkedScriptJob, range(len(jobs)), chunksize)
+            self.results = ((script, test, result) for (script, test), result in zip(jobs, jobResults))
+        try:
+            ActionRunner.notifyAllReadAndNotified(self)
+        finally:
+            if self.pool:
+                self.pool.terminate()
+                self.pool = None
+                self.results = None
+                # Don't keep the scripts alive, some of them report totals when deleted
+                forkedScriptJobs = []
+
+    def findParallelJobs(self):
+        scripts = {}
+        for app, appRunner in self.appRunners.items():
+            for action in appRunner.actionSequence:
+                if isinstance(action, plugins.ScriptWithArgs) and action.parallelSafe:
+                    action.precomputedResults = {}
+                    scripts[app] = action
+        if not scripts:
+            return []
+        # All tests are queued by now: take them out and put them back in the same order
+        tests = []
+        while True:
+            test = self.testQueue.get()
+            self.testQueue.put(test)
+            if test is None:
+                break
+            tests.append(test)
+        return [(scripts[test.app], test) for test in tests if test.app in scripts]
+
+    def runTest(self, test):
+        if test in self.jobTests:
+            self.collectResultsUpTo(test)
+        ActionRunner.runTest(self, test)
+
+    def collectResultsUpTo(self, test):
+        # Tests that are cancelled or already complete are never run, so skip over their results
+        for script, resultTest, (success, result) in self.results:
+            if success:
+                script.precomputedResults[resultTest] = result
+            if resultTest is test:
+                return
+            script.precomputedResults.pop(resultTest, None)
+
+
 class ActionsCompleteAction(plugins.Action):
     def __call__(self, test):
         test.actionsCompleted()
@@ -9,11 +9,17 @@ import logging
 import re
 import tarfile
 import stat
+import json
+import threading
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from texttestlib.default.batch import testoverview
+from texttestlib.default.performance import recordPerformanceHistory
+from texttestlib.default.reconnect import ReconnectIndex
 from texttestlib import plugins
 from .summarypages import GenerateSummaryPage, GenerateGraphs  # only so they become package level entities
 from collections import OrderedDict
-from .batchutils import getBatchRunName, BatchVersionFilter, parseFileName, convertToUrl
+from .batchutils import getBatchRunName, BatchVersionFilter, parseFileName, convertToUrl, RunEnvironmentIndex
 import subprocess
 from glob import glob
 
@@ -507,9 +513,11 @@ class SaveState(plugins.Responder):
     def notifyComplete(self, test):
         if test.state.isComplete():  # might look weird but this notification also comes in scripts, e.g collecting
             test.saveState()
+            ReconnectIndex.recordTest(test)
             if test.app in self.repositories:
                 self.diag.info("Saving " + repr(test) + " to repository")
                 self.saveToRepository(test)
+                recordPerformanceHistory(test, self.runPostfix)
             else:
                 self.diag.info("No repositories for " + repr(test.app) + " in " + repr(self.repositories))
 
@@ -543,22 +551,25 @@ class SaveState(plugins.Responder):
             self.repositories[suite.app] = os.path.abspath(testStateRepository)
             self.registerRunName(testStateRepository, suite.app)
 
-    def addVarsToRunFile(self, f, envVars):
+    def addVarsToRunFile(self, f, envVars, runEnv):
         for envVar in envVars: 
             if envVar in os.environ:
                 f.write(envVar + "=" + os.getenv(envVar) + "\n")
+                runEnv[envVar] = os.getenv(envVar)
             else:
                 return False
         return True
 
     def makeInitialRunFile(self, app, runFile):
         plugins.ensureDirExistsForFile(runFile)
+        runEnv = {}
         with open(runFile, "w") as f:
             jenkinsVars = ["JENKINS_URL", "JOB_NAME", "BUILD_NUMBER"]
-            if not self.addVarsToRunFile(f, jenkinsVars):
+            if not self.addVarsToRunFile(f, jenkinsVars, runEnv):
                 azdoVars = ["SYSTEM_TEAMFOUNDATIONSERVERURI", "SYSTEM_TEAMPROJECT", "BUILD_BUILDID", "BUILD_BUILDNUMBER" ]
-                self.addVarsToRunFile(f, azdoVars)
+                self.addVarsToRunFile(f, azdoVars, runEnv)
             f.write(repr(app) + "\n")
+        RunEnvironmentIndex.getInstance(os.path.dirname(runFile)).register(self.runPostfix, runEnv)
 
     def runAlreadyExists(self, runFile, app):
         text = repr(app)
@@ -590,6 +601,9 @@ class SaveState(plugins.Responder):
                 raise plugins.TextTestError("ERROR: Cannot run batch tests with run name '" + self.runPostfix + "', name has already been used for a different run\n" +
                                             "See file at " + runFile + ", which contains the entry '" + repr(app) + "'")
 
+    def notifyAllComplete(self):
+        ReconnectIndex.writeAll()
+
 
 class MigrateBatchRepository(plugins.Action):
     def __init__(self):
@@ -724,14 +738,85 @@ class ArchiveScript(plugins.ScriptWithArgs):
         return True
 
 
+class ArchiveManifest:
+    """ Records which teststate files have been written to which incremental archive, one line per archive.
+    Lines are only appended once an archive is complete, so an interrupted run can be resumed """
+
+    def __init__(self, repository, appName):
+        self.repository = repository
+        self.fileName = os.path.join(repository, appName + "_history_manifest.jsonl")
+        self.archivedFiles = set()
+        self.filesByTag = {}
+        self.reservedNames = set()
+        self.lock = threading.Lock()
+        self.read()
+
+    def read(self):
+        if os.path.isfile(self.fileName):
+            with open(self.fileName) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written last line from an interrupted run
+                    self.addEntry(entry["archive"], entry["files"])
+
+    def addEntry(self, archiveName, archivedFiles):
+        for archivedFile in archivedFiles:
+            self.archivedFiles.add(archivedFile)
+            tag = os.path.basename(archivedFile).replace("teststate_", "")
+            self.filesByTag.setdefault(tag, []).append((archiveName, archivedFile))
+
+    def isArchived(self, archivedFile):
+        return archivedFile in self.archivedFiles
+
+    def record(self, archiveName, archivedFiles):
+        with self.lock:
+            with open(self.fileName, "a") as f:
+                f.write(json.dumps({"archive": archiveName, "files": archivedFiles}) + "\n")
+            self.addEntry(archiveName, archivedFiles)
+
+    def getArchiveName(self, prefix):
+        with self.lock:
+            index = 1
+            while self.archiveExists(prefix + "_" + str(index) + ".tar.gz"):
+                index += 1
+            archiveName = prefix + "_" + str(index) + ".tar.gz"
+            self.reservedNames.add(archiveName)
+            return archiveName
+
+    def archiveExists(self, archiveName):
+        return archiveName in self.reservedNames or os.path.exists(os.path.join(self.repository, archiveName))
+
+    def findFilesFrom(self, dateStr):
+        startDate = dateInSeconds(dateStr)
+        filesByArchive = {}
+        for tag, archivedFiles in self.filesByTag.items():
+            tagDateStr = tag.split("_")[0]
+            if len(tagDateStr) == 9 and startDate <= dateInSeconds(tagDateStr):
+                for archiveName, archivedFile in archivedFiles:
+                    filesByArchive.setdefault(archiveName, set()).add(archivedFile)
+        return filesByArchive
+
+
 class ArchiveRepository(ArchiveScript):
     scriptDoc = "Archive parts of the batch result repository to a history directory"
+    periodFormats = {"month": "%b%Y", "year": "%Y"}
+    filesPerArchive = 10000
 
     def __init__(self, args):
-        argDict = self.parseArguments(args, ["before", "after", "weekday_pages_before", "name"])
+        argDict = self.parseArguments(args, ["before", "after", "weekday_pages_before", "name", "period", "processes"])
+        self.period = argDict.pop("period", None)
+        if self.period is not None and self.period not in self.periodFormats:
+            raise plugins.TextTestError("Cannot archive per '" + self.period + "' - period must be one of " +
+                                        ", ".join(sorted(self.periodFormats)))
+        processes = int(argDict.pop("processes", 0))
+        self.processes = processes if processes > 0 else cpu_count()
         ArchiveScript.__init__(self, argDict)
         self.name = self.extractArg(argDict, "name")
         self.weekdayBeforeDate = self.parseDate(argDict, "weekday_pages_before")
+        self.manifest = None
+        self.pendingFiles = {}
 
     def getRepository(self, suite):
         return getBatchRepository(suite)
@@ -746,16 +831,65 @@ class ArchiveRepository(ArchiveScript):
         runDir = os.path.join(os.path.dirname(self.repository), "run_names")
         if os.path.isdir(runDir):
             self.archiveFilesUnder(runDir, suite.app, weekdays, True)
+        if self.period:
+            self.manifest = ArchiveManifest(os.path.dirname(self.repository), suite.app.name)
         self.archiveVersionDirsUnder(self.repository, suite.app, weekdays, False)
 
     def archiveVersionDirsUnder(self, repository, app, *args):
         appVersions = set(app.versions)
+        versionDirs = []
         for directory in sorted(os.listdir(repository)):
             dirversions = set(directory.split("."))
             fullPath = os.path.join(repository, directory)
             if appVersions.issubset(dirversions) and os.path.isdir(fullPath):
+                versionDirs.append(fullPath)
+        if self.period:
+            pool = ThreadPool(min(self.processes, max(len(versionDirs), 1)))
+            try:
+                pool.map(lambda d: self.archiveVersionDirIncrementally(d, app, *args), versionDirs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for fullPath in versionDirs:
                 self.archiveFilesUnder(fullPath, app, *args)
 
+    def archiveVersionDirIncrementally(self, versionDir, app, *args):
+        self.pendingFiles[versionDir] = {}
+        self.archiveFilesUnder(versionDir, app, *args)
+        for period, stateFiles in sorted(self.pendingFiles.pop(versionDir).items()):
+            # Limit the archive size, so an interrupted run loses little work
+            for start in range(0, len(stateFiles), self.filesPerArchive):
+                prefix = "_".join([app.name, "history", os.path.basename(versionDir), period])
+                self.writeIncrementalArchive(prefix, stateFiles[start:start + self.filesPerArchive])
+
+    def writeIncrementalArchive(self, prefix, stateFiles):
+        repository = os.path.dirname(self.repository)
+        archiveName = self.manifest.getArchiveName(prefix)
+        tmpFile = os.path.join(repository, archiveName + ".tmp")
+        with tarfile.open(tmpFile, "w:gz") as tar:
+            for fullPath, archivedFile in stateFiles:
+                tar.add(fullPath, arcname=archivedFile)
+        os.replace(tmpFile, os.path.join(repository, archiveName))
+        self.manifest.record(archiveName, [archivedFile for _, archivedFile in stateFiles])
+        for fullPath, _ in stateFiles:
+            os.remove(fullPath)
+        plugins.log.info("Archived " + str(len(stateFiles)) + " files to " + archiveName)
+
+    def addToIncrementalArchive(self, fullPath, app):
+        repository = os.path.dirname(self.repository)
+        archivedFile = os.path.relpath(self.getTargetPath(fullPath, app.name), repository)
+        if self.manifest.isArchived(archivedFile):
+            # Archive was written by an earlier run that was interrupted before removing the file
+            os.remove(fullPath)
+            return True
+        versionDir = os.path.join(self.repository, os.path.relpath(fullPath, self.repository).split(os.sep)[0])
+        dateStr = os.path.basename(fullPath).replace("teststate_", "").split("_")[0]
+        timeStruct = time.strptime(dateStr, self.getDateFormat(dateStr))
+        period = time.strftime(self.periodFormats[self.period], timeStruct)
+        self.pendingFiles[versionDir].setdefault(period, []).append((fullPath, archivedFile))
+        return True
+
     def archiveRunFile(self, fullPath, app):
         appParts = set(repr(app).split("."))
         envVars, otherAppLines = [], []
@@ -783,6 +917,8 @@ class ArchiveRepository(ArchiveScript):
         if isRunFile:
             return self.archiveRunFile(fullPath, app)
         elif os.path.basename(fullPath).startswith("teststate"):
+            if self.period:
+                return self.addToIncrementalArchive(fullPath, app)
             return ArchiveScript.archiveFile(self, fullPath, app)
         linesToKeep = []
         archived = False
@@ -861,6 +997,9 @@ class ArchiveExtractor:
         archives = self.getArchives(suite)
         for archive in archives:
             self.extractUnder(archive, repository)
+        manifest = ArchiveManifest(repository, suite.app.name)
+        for archiveName, archivedFiles in manifest.findFilesFrom(self.dateStr).items():
+            self.extractUnder(os.path.join(repository, archiveName), repository, archivedFiles)
         self.repositories.append(os.path.join(repository, suite.app.name + "_history"))
 
     def getArchives(self, suite):
@@ -877,14 +1016,17 @@ class ArchiveExtractor:
         dateStr = tarFileName[startPos:startPos + 9]  # %d%b%Y dates are always of length 9
         return dateInSeconds(self.dateStr) <= dateInSeconds(dateStr)
 
-    def extractUnder(self, archivedFile, targetPath):
+    def extractUnder(self, archivedFile, targetPath, archivedFiles=None):
         tar = tarfile.open(archivedFile)
-        tar.extractall(targetPath, members=self.findFiles(tar))
+        tar.extractall(targetPath, members=self.findFiles(tar, archivedFiles))
         tar.close()
 
-    def findFiles(self, members):
+    def findFiles(self, members, archivedFiles):
         for tarinfo in members:
-            if self.shouldExtract(os.path.split(tarinfo.name)[1]):
+            if archivedFiles is not None:
+                if tarinfo.name in archivedFiles:
+                    yield tarinfo
+            elif self.shouldExtract(os.path.split(tarinfo.name)[1]):
                 yield tarinfo
 
     def shouldExtract(self, fileName):
@@ -1,6 +1,7 @@
 import datetime
 import time
 import os
+import json
 from texttestlib import plugins
 
 
@@ -64,16 +65,86 @@ def parseFileName(fileName, diag):
 def getEnvironmentFromRunFiles(runNameDirs, tag):
     env = {}
     for dir in runNameDirs:
-        path = os.path.join(dir, tag)
-        if os.path.isfile(path):
-            with open(path) as f:
-                for line in f:
-                    if "=" in line:
-                        var, val = line.strip().split("=", 1)
-                        env[var] = val
+        env.update(RunEnvironmentIndex.getInstance(dir).getEnvironment(tag))
     return env
 
 
+def readRunFileEnvironment(path):
+    env = {}
+    with open(path) as f:
+        for line in f:
+            if "=" in line:
+                var, val = line.strip().split("=", 1)
+                env[var] = val
+    return env
+
+
+class RunEnvironmentIndex:
+    """ The environment variables recorded in each file in a run_names directory. Kept in memory
+    and in an index file next to the directory, so each run file only needs to be read once.
+    The index is not inside run_names, where archiving expects every file to be a run tag """
+    instances = {}
+
+    @classmethod
+    def getInstance(cls, runDir):
+        runDir = os.path.normpath(runDir)
+        if runDir not in cls.instances:
+            cls.instances[runDir] = cls(runDir)
+        return cls.instances[runDir]
+
+    def __init__(self, runDir):
+        self.runDir = runDir
+        self.indexFile = runDir + "_environment.json"
+        self.environments = None
+
+    def getEnvironment(self, tag):
+        if self.environments is None:
+            self.environments = self.readEnvironments()
+        return dict(self.environments.get(tag, {}))
+
+    def readEnvironments(self):
+        if not os.path.isdir(self.runDir):
+            return {}
+        cachedEnvironments = self.readIndex()
+        environments = {}
+        # One directory listing tells us which runs have been added or archived since the index was written
+        for tag in os.listdir(self.runDir):
+            if tag in cachedEnvironments:
+                environments[tag] = cachedEnvironments[tag]
+            else:
+                path = os.path.join(self.runDir, tag)
+                if os.path.isfile(path):
+                    environments[tag] = readRunFileEnvironment(path)
+        if environments != cachedEnvironments:
+            self.writeIndex(environments)
+        return environments
+
+    def readIndex(self):
+        if os.path.isfile(self.indexFile):
+            try:
+                with open(self.indexFile) as f:
+                    return json.load(f)
+            except (EnvironmentError, ValueError):
+                pass
+        return {}
+
+    def writeIndex(self, environments):
+        tmpFile = self.indexFile + "." + str(os.getpid())
+        try:
+            with open(tmpFile, "w") as f:
+                json.dump(environments, f, sort_keys=True)
+            os.replace(tmpFile, self.indexFile)
+        except EnvironmentError:
+            pass  # Only a cache, we may not have write permission to the repository
+
+    def register(self, tag, env):
+        if self.environments is not None:
+            self.environments[tag] = env
+        environments = self.readIndex()
+        environments[tag] = env
+        self.writeIndex(environments)
+
+
 def convertToUrl(path, fileMapping):
     for filePath, httpPath in list(fileMapping.items()):
         if path.startswith(filePath):
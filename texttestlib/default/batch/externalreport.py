@@ -1,13 +1,16 @@
 
 import logging
 import os
+import shutil
 from collections import OrderedDict
 from .batchutils import getBatchRunName
 from string import Template
 from locale import getpreferredencoding
 from texttestlib import plugins
 from texttestlib.default.performance import getPerformance
-from xml.sax.saxutils import escape
+from xml.sax.saxutils import escape, quoteattr
+from xml.parsers import expat
+from tempfile import TemporaryFile
 import uuid
 from datetime import datetime
 from glob import glob
@@ -19,6 +22,10 @@ def getExternalFormat(app):
 def getFileExtension(fmt):
     return fmt if fmt == "trx" else "xml"
 
+def escapeAttribute(value):
+    # Goes inside double-quoted attribute values in the templates
+    return escape(value, {'"': "&quot;"})
+
 def getBatchExternalFolder(app, extFormat):
     resultsDir = app.getBatchConfigValue("batch_external_folder")
     if (resultsDir is None or resultsDir.strip() == ""):
@@ -120,9 +127,9 @@ class ExternalFormatApplicationData:
             startTime = datetime.utcfromtimestamp(0)
             endTime = startTime
         result = dict(id=self.runId,
-                      run_name=self.runName,
-                      test_description=test.description,
-                      full_test_name=self._fullTestName(test),
+                      run_name=escapeAttribute(self.runName),
+                      test_description=escape(test.description),
+                      full_test_name=escapeAttribute(self._fullTestName(test)),
                       test_id=self.make_guid(),
                       execution_id=self.make_guid(),
                       test_name=test.name,
@@ -132,7 +139,7 @@ class ExternalFormatApplicationData:
                       start_time=startTime.isoformat(),
                       end_time=endTime.isoformat(),
                       duration=self.formatDuration(endTime - startTime, extFormat),
-                      host=",".join(test.state.executionHosts),
+                      host=escapeAttribute(",".join(test.state.executionHosts)),
                       short_message=self._shortMessage(test))
         long_message = self._longMessage(test, extFormat)
         if not test.state.hasResults():
@@ -338,6 +345,8 @@ class ExternalFormatCollector(plugins.Responder):
         allFiles = {}
         for app in self.allApps:
             extFormat = getExternalFormat(app)
+            if self.getFormatTagInfo(extFormat) is None:
+                continue
             resultsDir = getBatchExternalFolder(app, extFormat)
             appResultsDir = os.path.join(resultsDir, app.name + app.versionSuffix())
             fileExt = getFileExtension(extFormat)
@@ -355,77 +364,117 @@ class ExternalFormatCollector(plugins.Responder):
     @classmethod
     def getFormatTagInfo(cls, extFormat):
         if extFormat == "trx":
-            return {"Counters" : {}, "ResultSummary" : {}}, ("GenericTestResult", "GenericTest", "TestEntry")
+            return ("Counters", "ResultSummary"), ("GenericTestResult", "GenericTest", "TestEntry")
         elif extFormat == "jetbrains":
-            return {'count name="total"' : {}, 'count name="failed"': {}, 'count name="passed"': {}}, ("test",)
-                
-    @classmethod     
+            return ("count",), ("test",)
+
+    @classmethod
     def combineFiles(cls, sourceFns, targetFn, extFormat):
-        entries = {}
         summaryTags, entryTags = cls.getFormatTagInfo(extFormat)
-        for fn in sourceFns:
-            with open(fn) as f:
-                currTag = None
-                for rawline in f:
-                    line = rawline.strip()
-                    tagClosed = False
-                    if line.startswith("<"):
-                        lineContent = line.lstrip("<").rstrip("/> ")
-                        summaryTag, summaryDict = cls.getSummaryInfo(lineContent, summaryTags)
-                        if summaryDict is not None:
-                            remainingLine = lineContent.replace(summaryTag + " ", "")
-                            cls.updateSummary(summaryDict, remainingLine.split())
-                        else:
-                            entryTag, tagClosed = cls.getEntryTag(line, entryTags)
-                            if entryTag:
-                                currTag = entryTag                         
-                    if currTag:
-                        entries[currTag] = entries.get(currTag, "") + rawline
-                    if tagClosed:
-                        currTag = None
-
-        templateFn = sourceFns[0]
-        with open(targetFn, "w") as wf:
-            with open(templateFn) as f:
-                currTag = None
-                for rawline in f:
-                    line = rawline.lstrip(" <").rstrip("/> \n")
-                    summaryTag, summaryDict = cls.getSummaryInfo(line, summaryTags)
-                    if summaryDict is not None:
-                        summaryLine = summaryTag + " " + cls.getSummaryLine(summaryDict)
-                        wf.write(rawline.replace(line, summaryLine))
-                        continue
-                    
-                    entryTag, closed = cls.getEntryTag(rawline.strip(), entryTags)
-                    if entryTag:
-                        currTag = None if closed else entryTag
-                        if entryTag in entries:
-                            entry = entries.pop(entryTag)
-                            wf.write(entry)
-                    elif currTag is None:
-                        wf.write(rawline)
-                   
-    @classmethod
-    def getEntryTag(cls, line, entryTags):
-        for entryTag in entryTags:
-            if line.startswith("<" + entryTag + " ") or line.startswith("<" + entryTag + ">"):
-                return entryTag, "/>" in line
-            elif line.startswith("</" + entryTag + ">"):
-                return entryTag, True
-        return None, False
-                        
-    @classmethod
-    def getSummaryInfo(cls, line, summaryTags):
-        for summaryTag, summaryDict in summaryTags.items():
-            if line.startswith(summaryTag):
-                return summaryTag, summaryDict
-        return None, None
-             
-    @classmethod           
-    def updateSummary(cls, summary, words):
-        for word in words:
-            key, rawValue = word.split("=")
-            value = eval(rawValue)
+        combiner = ExternalFormatCombiner(summaryTags, entryTags)
+        try:
+            for fn in sourceFns:
+                combiner.addFile(fn)
+            combiner.write(targetFn)
+        finally:
+            combiner.close()
+
+
+class ExternalFormatCombiner:
+    """ Combines per-test report files into one, a file at a time. Each entry is copied byte for byte
+    into a spool file for its tag, and the summary counters are added up as we go. The first file is
+    then used as a template for the combined file, with its own entries replaced by the spooled ones """
+    def __init__(self, summaryTags, entryTags):
+        self.summaryTags = summaryTags
+        self.entryTags = entryTags
+        self.summaries = OrderedDict()
+        self.spoolFiles = OrderedDict((tag, TemporaryFile()) for tag in entryTags)
+        self.templateData = None
+        self.templateParts = []
+        self.diag = logging.getLogger("external format collect")
+
+    def close(self):
+        for spoolFile in self.spoolFiles.values():
+            spoolFile.close()
+
+    def addFile(self, fn):
+        with open(fn, "rb") as f:
+            data = f.read()
+        # Collect everything from this file first: nothing is added unless the whole file parses
+        entries, summaryUpdates, templateParts = [], [], []
+        parser = expat.ParserCreate()
+        currEntry = []
+
+        def startElement(tag, attrs):
+            start = parser.CurrentByteIndex
+            if currEntry:
+                return
+            if tag in self.summaryTags:
+                summaryKey = tag, attrs.get("name")
+                summaryUpdates.append((summaryKey, attrs))
+                templateParts.append((start, self.findTagEnd(data, start), summaryKey))
+            elif tag in self.entryTags:
+                tagEnd = self.findTagEnd(data, start)
+                currEntry[:] = [tag, start, tagEnd]
+                if data[tagEnd - 2:tagEnd] == b"/>":
+                    self.addEntry(data, tag, start, tagEnd, entries, templateParts)
+                    currEntry[:] = []
+
+        def endElement(tag):
+            if currEntry and currEntry[0] == tag:
+                end = data.index(b">", parser.CurrentByteIndex) + 1
+                self.addEntry(data, tag, currEntry[1], end, entries, templateParts)
+                currEntry[:] = []
+
+        parser.StartElementHandler = startElement
+        parser.EndElementHandler = endElement
+        try:
+            parser.Parse(data, True)
+        except expat.ExpatError as e:
+            plugins.printWarning("Could not parse external format file at " + fn + ", ignoring it: " + str(e))
+            return
+
+        for tag, entryData in entries:
+            self.spoolFiles[tag].write(entryData)
+        for summaryKey, attrs in summaryUpdates:
+            self.updateSummary(self.summaries.setdefault(summaryKey, OrderedDict()), attrs)
+        if self.templateData is None:
+            self.templateData = data
+            self.templateParts = templateParts
+
+    def addEntry(self, data, tag, start, end, entries, templateParts):
+        start, end = self.expandToLines(data, start, end)
+        entries.append((tag, data[start:end]))
+        templateParts.append((start, end, tag))
+
+    @staticmethod
+    def expandToLines(data, start, end):
+        # Include indentation and line ending, so entries appear in the combined file as they were
+        lineStart = data.rfind(b"\n", 0, start) + 1
+        if not data[lineStart:start].strip():
+            start = lineStart
+        lineEnd = data.find(b"\n", end)
+        if lineEnd != -1 and not data[end:lineEnd].strip():
+            end = lineEnd + 1
+        return start, end
+
+    @staticmethod
+    def findTagEnd(data, start):
+        quote = None
+        for pos in range(start, len(data)):
+            char = data[pos:pos + 1]
+            if quote:
+                if char == quote:
+                    quote = None
+            elif char in (b'"', b"'"):
+                quote = char
+            elif char == b">":
+                return pos + 1
+        return len(data)
+
+    @staticmethod
+    def updateSummary(summary, attrs):
+        for key, value in attrs.items():
             numeric = value.isdigit()
             if numeric:
                 value = int(value)
@@ -437,9 +486,25 @@ class ExternalFormatCollector(plugins.Responder):
             else:
                 # prefer error to failure to success, happens to be alphabetic
                 summary[key] = min(oldValue, value)
-                            
-    @classmethod
-    def getSummaryLine(cls, data):
-        texts = [ key + '="' + str(value) + '"' for key, value in data.items() ]
-        return " ".join(texts)
-            
\ No newline at end of file
+
+    def getSummaryTag(self, summaryKey, origTag):
+        texts = [summaryKey[0]] + [key + "=" + quoteattr(str(value)) for key, value in self.summaries[summaryKey].items()]
+        tagContent = origTag.rstrip(b"/>")
+        ending = origTag[len(tagContent.rstrip()):].decode()
+        return ("<" + " ".join(texts) + ending).encode("utf-8")
+
+    def write(self, targetFn):
+        pos = 0
+        with open(targetFn, "wb") as wf:
+            for start, end, key in self.templateParts:
+                wf.write(self.templateData[pos:start])
+                if isinstance(key, tuple):
+                    wf.write(self.getSummaryTag(key, self.templateData[start:end]))
+                elif key in self.spoolFiles:
+                    self.diag.info("Writing all " + key + " entries")
+                    spoolFile = self.spoolFiles.pop(key)
+                    spoolFile.seek(0)
+                    shutil.copyfileobj(spoolFile, wf)
+                    spoolFile.close()
+                pos = end
+            wf.write(self.templateData[pos:])
@@ -5,6 +5,9 @@ import hashlib
 import time
 import codecs
 import locale
+import sqlite3
+import threading
+from ast import literal_eval
 from xml.dom.minidom import parse
 from collections import OrderedDict
 from glob import glob
@@ -25,6 +28,19 @@ class FingerprintNotReadyException(RuntimeError):
     pass
 
 
+def getJenkinsHost():
+    urlParts = os.getenv("JENKINS_URL", "").split("/")
+    return urlParts[2].replace(":", "") if len(urlParts) > 2 else ""
+
+
+def getFileSignature(fileName):
+    try:
+        stat = os.stat(fileName)
+        return "%d:%d" % (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        pass
+
+
 def getBuildsDir(jobRoot, jobName):
     projectDir = os.path.join(jobRoot, jobName)
     local = os.path.join(projectDir, "builds")
@@ -62,6 +78,10 @@ class BuildDocument:
             for entry in obj.getElementsByTagName("string"):
                 yield entry.childNodes[0].nodeValue
 
+    def fingerprintPairs(self):
+        strings = list(self.fingerprintStrings())
+        return list(zip(strings[::2], strings[1::2]))
+
     def getResult(self):
         for entry in self.document.getElementsByTagName("result"):
             return entry.childNodes[0].nodeValue
@@ -87,43 +107,191 @@ class BuildDocument:
                 return any(("SCMTrigger" in childNode.nodeName for childNode in causes.childNodes))
 
     def getFingerprint(self, ignoreArtefact):
-        prevString = None
+        return self.makeFingerprint(self.fingerprintPairs(), ignoreArtefact)
+
+    @classmethod
+    def makeFingerprint(cls, pairs, ignoreArtefact):
         fingerprint = {}
-        for currString in self.fingerprintStrings():
-            if prevString:
-                if ignoreArtefact not in prevString:
-                    vregex = self.versionRegexRpm if prevString.endswith(".rpm") else self.versionRegex
-                    match = vregex.search(prevString)
-                    regex = prevString
-                    if match:
-                        regex = prevString.replace(match.group(0), vregex.pattern) + "$"
-                    fingerprint[regex] = currString, prevString
-                prevString = None
-            else:
-                prevString = currString
+        for fileName, hash in pairs:
+            if ignoreArtefact not in fileName:
+                vregex = cls.versionRegexRpm if fileName.endswith(".rpm") else cls.versionRegex
+                match = vregex.search(fileName)
+                regex = fileName
+                if match:
+                    regex = fileName.replace(match.group(0), vregex.pattern) + "$"
+                fingerprint[regex] = hash, fileName
         return fingerprint
 
 
+class StoredBuild:
+    """ The same information as a BuildDocument, for a finished build, read from the FingerprintStore """
+    def __init__(self, store, jobName, buildName, result, sourceChange):
+        self.store = store
+        self.jobName = jobName
+        self.buildName = buildName
+        self.result = result
+        self.sourceChange = sourceChange
+
+    def getResult(self):
+        return self.result
+
+    def hasSourceCodeChange(self):
+        return self.sourceChange
+
+    def checkHashes(self, oldHashes, newHashes):
+        hash = self.store.findFirstHash(self.jobName, self.buildName, set(oldHashes).union(newHashes))
+        if hash is None:
+            return False, False
+        return True, hash not in oldHashes
+
+    def getArtefactVersion(self, artefactRegex):
+        for fileName, _ in self.store.getFingerprintPairs(self.jobName, self.buildName):
+            if artefactRegex.match(fileName):
+                versionMatch = BuildDocument.versionRegex.search(fileName)
+                if versionMatch:
+                    return versionMatch.group(0)
+
+    def getFingerprint(self, ignoreArtefact):
+        pairs = self.store.getFingerprintPairs(self.jobName, self.buildName)
+        return BuildDocument.makeFingerprint(pairs, ignoreArtefact)
+
+
+class FingerprintStore:
+    """ SQLite database of what we've read from Jenkins' build.xml files, so each finished build is only
+    parsed once, and of the hashes we've verified by checking the archived artefacts """
+    fileName = "jenkins_fingerprints.db"
+
+    def __init__(self, cacheDir):
+        self.host = getJenkinsHost()
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        self.connection = sqlite3.connect(os.path.join(cacheDir, self.fileName), timeout=60)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS builds (host TEXT, job TEXT, build TEXT, signature TEXT, "
+                                    "result TEXT, sourceChange INTEGER, PRIMARY KEY (host, job, build))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints (host TEXT, job TEXT, build TEXT, "
+                                    "position INTEGER, file TEXT, hash TEXT, PRIMARY KEY (host, job, build, position))")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS verified_hashes (host TEXT, job TEXT, build TEXT, "
+                                    "file TEXT, hash TEXT, PRIMARY KEY (host, job, build, file))")
+
+    def close(self):
+        self.connection.close()
+
+    def getBuild(self, buildsDir, jobName, buildName):
+        signature = getFileSignature(os.path.join(buildsDir, buildName, "build.xml"))
+        if signature is None:
+            return
+        row = self.connection.execute("SELECT result, sourceChange FROM builds WHERE host=? AND job=? AND build=? AND signature=?",
+                                      (self.host, jobName, buildName, signature)).fetchone()
+        if row:
+            return StoredBuild(self, jobName, buildName, row[0], bool(row[1]))
+
+        document = BuildDocument.create(buildsDir, buildName)
+        # Only finished builds are stored, running ones will have more written to them
+        if document is not None and document.getResult() is not None:
+            self.storeBuild(jobName, buildName, signature, document)
+        return document
+
+    def storeBuild(self, jobName, buildName, signature, document):
+        key = self.host, jobName, buildName
+        with self.connection:
+            self.connection.execute("DELETE FROM fingerprints WHERE host=? AND job=? AND build=?", key)
+            self.connection.executemany("INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?, ?)",
+                                        (key + (position, fileName, hash)
+                                         for position, (fileName, hash) in enumerate(document.fingerprintPairs())))
+            self.connection.execute("INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?)",
+                                    key + (signature, document.getResult(), bool(document.hasSourceCodeChange())))
+
+    def getFingerprintPairs(self, jobName, buildName):
+        return self.connection.execute("SELECT file, hash FROM fingerprints WHERE host=? AND job=? AND build=? ORDER BY position",
+                                       (self.host, jobName, buildName)).fetchall()
+
+    def findFirstHash(self, jobName, buildName, hashes):
+        hashes = [hash for hash in hashes if hash is not None]
+        if hashes:
+            query = "SELECT hash FROM fingerprints WHERE host=? AND job=? AND build=? AND hash IN (" + \
+                ", ".join("?" * len(hashes)) + ") ORDER BY position LIMIT 1"
+            row = self.connection.execute(query, [self.host, jobName, buildName] + hashes).fetchone()
+            if row:
+                return row[0]
+
+    def getVerifiedHashes(self, jobName, buildName):
+        return dict(self.connection.execute("SELECT file, hash FROM verified_hashes WHERE host=? AND job=? AND build=?",
+                                            (self.host, jobName, buildName)))
+
+    def setVerifiedHash(self, jobName, buildName, fileName, hash):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO verified_hashes VALUES (?, ?, ?, ?, ?)",
+                                    (self.host, jobName, buildName, fileName, hash))
+
+
+class FileChangeWaiter:
+    """ Waits for a file to be written, using watchdog's notifications if it's installed, otherwise
+    checking its size and modification time a few times a second.
+    Note Jenkins replaces its files rather than modifying them, so we react to any event in the directory """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.signature = getFileSignature(fileName)
+        self.changed = threading.Event()
+        self.observer = None
+        self.checkInterval = 0.2
+
+    def startObserver(self):
+        dirName = os.path.dirname(self.fileName)
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return
+        if not os.path.isdir(dirName):
+            return
+
+        changed = self.changed
+        class ChangeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                changed.set()
+
+        self.observer = Observer()
+        self.observer.schedule(ChangeHandler(), dirName)
+        self.observer.start()
+        self.checkInterval = 5
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+
+    def waitForChange(self, timeout):
+        if self.observer is None:
+            self.startObserver()
+        deadline = time.time() + timeout
+        while True:
+            signature = getFileSignature(self.fileName)
+            if signature != self.signature:
+                self.signature = signature
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            self.changed.wait(min(remaining, self.checkInterval))
+            self.changed.clear()
+
+
 class FingerprintVerifier:
     def __init__(self, fileFinder, cacheDir):
         self.fileFinder = fileFinder
         self.cacheDir = cacheDir
 
     def getCacheFileName(self, jobName, buildName):
-        rootName = "correct_hashes_" + os.getenv("JENKINS_URL").split("/")[2].replace(":", "")
+        rootName = "correct_hashes_" + getJenkinsHost()
         return os.path.join(self.cacheDir, rootName, jobName, buildName)
 
     def getCachedFingerprint(self, jobName, buildName):
+        # Corrected hashes are now in the FingerprintStore, but still read those written by earlier versions
         cacheFileName = self.getCacheFileName(jobName, buildName)
         if os.path.isfile(cacheFileName):
-            return eval(open(cacheFileName).read())
-
-    def writeCache(self, jobName, buildName, updatedHashes):
-        cacheFileName = self.getCacheFileName(jobName, buildName)
-        from texttestlib import plugins
-        plugins.ensureDirExistsForFile(cacheFileName)
-        with open(cacheFileName, "w") as f:
-            pprint(updatedHashes, f)
+            with open(cacheFileName) as f:
+                return literal_eval(f.read())
 
     def md5sum(self, filename):
         md5 = hashlib.md5()
@@ -132,20 +300,20 @@ class FingerprintVerifier:
                 md5.update(chunk)
         return md5.hexdigest()
 
-    def getCorrectedHash(self, buildsDir, build, f, hash):
+    def getArchivedHash(self, buildsDir, build, f):
         fullFileFinder = os.path.join(buildsDir, build, self.fileFinder)
         filePattern = f.split(":")[-1].replace("-", "?")
         paths = glob(os.path.join(fullFileFinder, filePattern))
         if len(paths):
-            path = paths[0]
-            correctHash = self.md5sum(path)
-            if correctHash != hash:
-                return correctHash
+            return self.md5sum(paths[0])
 
 
 class FingerprintDifferenceFinder:
-    def __init__(self, jobRoot, fileFinder, cacheDir):
+    fingerprintWaitTime = 500
+
+    def __init__(self, jobRoot, fileFinder, cacheDir, store):
         self.jobRoot = jobRoot
+        self.store = store
         self.verifier = FingerprintVerifier(fileFinder, cacheDir) if fileFinder else None
 
     def findDifferences(self, jobName, build1, build2):
@@ -158,6 +326,7 @@ class FingerprintDifferenceFinder:
             return [], bool(fingerprint2)
         differences = []
         updatedHashes = {}
+        verifiedHashes = self.store.getVerifiedHashes(jobName, build2) if self.verifier else {}
         for artefact, value in list(fingerprint2.items()):
             if isinstance(value, tuple):
                 hash2 = value[0]
@@ -169,11 +338,13 @@ class FingerprintDifferenceFinder:
             if isinstance(hash1, tuple):
                 hash1 = hash1[0]
             if hash1 != hash2:
-                if self.verifier:
-                    correctedHash = self.verifier.getCorrectedHash(buildsDir, build2, file2, hash2)
-                    if correctedHash:
-                        hash2 = correctedHash
-                        updatedHashes[artefact] = hash2
+                if self.verifier and file2 not in verifiedHashes:
+                    archivedHash = self.verifier.getArchivedHash(buildsDir, build2, file2)
+                    if archivedHash:
+                        self.store.setVerifiedHash(jobName, build2, file2, archivedHash)
+                        if archivedHash != hash2:
+                            updatedHashes[artefact] = hash2, archivedHash
+                            hash2 = archivedHash
                     if hash1 == hash2:
                         continue
                 differences.append((artefact, hash1, hash2))
@@ -181,26 +352,26 @@ class FingerprintDifferenceFinder:
         if updatedHashes:
             print("WARNING: incorrect hashes found!")
             print("This is probably due to fingerprint data being wrongly updated from artefacts produced during the build")
-            print("Storing a cached file of corrected versions. The following were changed:")
-            for artefact, hash in list(updatedHashes.items()):
-                print(artefact, fingerprint2.get(artefact)[0], hash)
-
-            for artefact, (hash2, file2) in list(fingerprint2.items()):
-                if artefact not in updatedHashes:
-                    updatedHashes[artefact] = hash2
-            self.verifier.writeCache(jobName, build2, updatedHashes)
+            print("Storing corrected versions in the fingerprint database. The following were changed:")
+            for artefact, (oldHash, hash) in list(updatedHashes.items()):
+                print(artefact, oldHash, hash)
 
         differences.sort()
         return differences, True
 
-    def getAndWaitForFingerprint(self, *args):
-        for i in range(500):
-            try:
-                return self.getFingerprint(*args)
-            except FingerprintNotReadyException:
-                if i % 10 == 0:
-                    print("No Jenkins fingerprints available yet, sleeping...")
-                time.sleep(1)
+    def getAndWaitForFingerprint(self, buildsDir, jobName, buildName):
+        waiter = FileChangeWaiter(os.path.join(buildsDir, buildName, "build.xml"))
+        deadline = time.time() + self.fingerprintWaitTime
+        try:
+            while True:
+                try:
+                    return self.getFingerprint(buildsDir, jobName, buildName)
+                except FingerprintNotReadyException:
+                    print("No Jenkins fingerprints available yet, waiting for them to be written...")
+                    if not waiter.waitForChange(deadline - time.time()):
+                        break
+        finally:
+            waiter.stop()
 
         print("Giving up waiting for fingerprints.")
         raise JobStillRunningException()
@@ -211,8 +382,12 @@ class FingerprintDifferenceFinder:
             if cached:
                 return cached
 
-        document = BuildDocument.create(buildsDir, buildName)
+        document = self.store.getBuild(buildsDir, jobName, buildName)
         fingerprint = document.getFingerprint(jobName) if document is not None else {}
+        if fingerprint and self.verifier:
+            verifiedHashes = self.store.getVerifiedHashes(jobName, buildName)
+            for artefact, (hash, fileName) in list(fingerprint.items()):
+                fingerprint[artefact] = verifiedHashes.get(fileName, hash), fileName
         if not fingerprint:
             result = document.getResult() if document is not None else None
             if result is None and os.getenv("BUILD_NUMBER") == buildName and os.getenv("JOB_NAME") == jobName:
@@ -415,14 +590,19 @@ class ProjectData:
 
 
 class ChangeFinder:
-    def __init__(self, bugSystemData, markedArtefacts, *args):
+    def __init__(self, bugSystemData, markedArtefacts, fileFinder, cacheDir):
         self.jobRoot = os.path.join(os.getenv("JENKINS_HOME"), "jobs")
         self.jobName = os.getenv("JOB_NAME")
         self.projectData = ProjectData(self.jobRoot)
         self.markedArtefacts = markedArtefacts
         self.changeSetFinder = ChangeSetFinder(self.jobRoot, os.getenv("JENKINS_URL"), bugSystemData)
-        self.diffFinder = FingerprintDifferenceFinder(self.jobRoot, *args)
+        self.store = FingerprintStore(cacheDir)
+        self.diffFinder = FingerprintDifferenceFinder(self.jobRoot, fileFinder, cacheDir, self.store)
         self.handledProjects = []
+
+    def close(self):
+        self.store.close()
+
     def findChanges(self, build1, build2):
         try:
             markedChanges, projectChanges, fingerprintsFound = self.getChangesRecursively(self.jobName, build1, build2)
@@ -492,7 +672,7 @@ class ChangeFinder:
             scopeProvided = any((s for _, _, _, s in diffs))
             activeBuild = None
             for build in allBuilds:
-                document = BuildDocument.create(buildsDir, build)
+                document = self.store.getBuild(buildsDir, project, build)
                 if not document:
                     continue
 
@@ -512,7 +692,7 @@ class ChangeFinder:
     def hasSourceCodeChange(self, build):
         buildsDir = getBuildsDir(self.jobRoot, self.jobName)
         if buildsDir:
-            doc = BuildDocument.create(buildsDir, build)
+            doc = self.store.getBuild(buildsDir, self.jobName, build)
             if doc:
                 return doc.hasSourceCodeChange()
         return False
@@ -520,8 +700,8 @@ class ChangeFinder:
     def getMarkChangeText(self, artefact, projectName, build1, build2):
         buildsDir = getBuildsDir(self.jobRoot, self.jobName)
         regex = re.compile(artefact)
-        version1 = BuildDocument.create(buildsDir, build1).getArtefactVersion(regex)
-        version2 = BuildDocument.create(buildsDir, build2).getArtefactVersion(regex)
+        version1 = self.store.getBuild(buildsDir, self.jobName, build1).getArtefactVersion(regex)
+        version2 = self.store.getBuild(buildsDir, self.jobName, build2).getArtefactVersion(regex)
         projectNameForDisplay = os.path.basename(projectName)
         if version1 == version2:
             return projectNameForDisplay + " was updated", "", []
@@ -534,7 +714,10 @@ class ChangeFinder:
 
 def getChanges(build1, build2, *args):
     finder = ChangeFinder(*args)
-    return finder.findChanges(build1, build2)
+    try:
+        return finder.findChanges(build1, build2)
+    finally:
+        finder.close()
 
 
 def getTimestamp(build):
@@ -15,6 +15,7 @@ from .batchutils import BatchVersionFilter, parseFileName, convertToUrl, getEnvi
 import datetime
 from functools import reduce
 import urllib.parse
+import json
 
 
 class GenerateFromSummaryData(plugins.ScriptWithArgs):
@@ -147,7 +148,10 @@ class SummaryDataFinder:
 
     @staticmethod
     def findFullName(dirName):
-        # All files have the application in the title attribute
+        index = testoverview.readSummaryIndex(dirName)
+        if index is not None:
+            return index.get("application")
+        # Reports from before the index was written: all files have the application in the title attribute
         htmlFiles = glob(os.path.join(dirName, "test_*.html"))
         if len(htmlFiles) == 0:
             return
@@ -210,7 +214,7 @@ class SummaryDataFinder:
 
     def getVersionInfoFor(self, appDir):
         versionDates = {}
-        for path in sorted(glob(os.path.join(appDir, "test_*.html"))):
+        for path in self.findPageFiles(appDir):
             fileName = os.path.basename(path)
             version, date, tag = parseFileName(fileName, self.diag)
             if version:
@@ -221,6 +225,11 @@ class SummaryDataFinder:
                     versionDates[version][(date, tag)] = path
         return versionDates
 
+    def findPageFiles(self, appDir):
+        # Not from the summary index: pages may have been removed since it was written, or written by
+        # something that didn't update it. Every page it lists matches this anyway
+        return sorted(glob(os.path.join(appDir, "test_*.html")))
+
     def getOverviewPageName(self, version):
         return "test_" + version + ".html"
 
@@ -345,17 +354,27 @@ class SummaryDataFinder:
         return summaries
 
     def extractSummary(self, datedFile, summary):
+        sidecarFile = testoverview.getSummarySidecarFile(datedFile)
+        if os.path.isfile(sidecarFile):
+            with open(sidecarFile) as f:
+                categories = json.load(f).get("categories", [])
+            # Category names as they appear in the HTML summary text, with spaces removed
+            self.addToSummary(self.getColourCounts([["".join(name.split()), count] for name, count in categories]), summary)
+            return summary
         for line in open(datedFile, errors="replace"):
             if line.strip().startswith("<H2>"):
                 text = line.strip()[4:-5]  # drop the tags
-                for cat, num in list(self.parseSummaryText(text).items()):
-                    if cat in summary:
-                        summary[cat] += num
-                    else:
-                        summary[cat] = num
+                self.addToSummary(self.parseSummaryText(text), summary)
                 return summary
         return summary
 
+    def addToSummary(self, colourCount, summary):
+        for cat, num in list(colourCount.items()):
+            if cat in summary:
+                summary[cat] += num
+            else:
+                summary[cat] = num
+
     def parseSummaryText(self, text):
         words = text.split()[3:]  # Drop "Version: 12 tests"
         index = 0
@@ -368,6 +387,9 @@ class SummaryDataFinder:
                 categories[-1][0] += words[index]
             index += 1
         self.diag.info("Category information is " + repr(categories))
+        return self.getColourCounts(categories)
+
+    def getColourCounts(self, categories):
         colourCount = OrderedDict()
         for colourKey in ["success", "knownbug", "performance", "failure", "incomplete"]:
             colourCount[colourKey] = 0
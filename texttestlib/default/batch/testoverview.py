@@ -5,11 +5,16 @@ import os
 import time
 import html
 import sys
+import json
 import logging
 import locale
+import shutil
+import tempfile
+import multiprocessing
 from texttestlib.default.batch import HTMLgen, HTMLcolors, jenkinschanges
 from texttestlib import plugins
 from collections import OrderedDict
+from functools import partial
 from glob import glob
 from pprint import pformat
 from datetime import datetime, timedelta
@@ -17,6 +22,13 @@ from .batchutils import convertToUrl, getEnvironmentFromRunFiles
 import urllib.parse
 HTMLgen.PRINTECHO = 0
 
+# Set in the parent process while a pool is running, so forked workers can use it without pickling it
+forkedGenerator = None
+
+
+def callForkedGenerator(methodName, arg):
+    return getattr(forkedGenerator, methodName)(arg)
+
 
 def parseState(state):
     '''Separate brief text and host list from succeeded_runs file, e.g.
@@ -67,6 +79,32 @@ def makeTestId(version, extraVersion, testName):
     return testId
 
 
+def getSummarySidecarFile(pageFile):
+    # Machine-readable summary of a detail page, so the summary page doesn't need to parse the HTML
+    return pageFile[:-5] + ".json"
+
+
+def getSummaryIndexFile(pageDir):
+    return os.path.join(pageDir, "summary_index.json")
+
+
+def readSummaryIndex(pageDir):
+    indexFile = getSummaryIndexFile(pageDir)
+    if os.path.isfile(indexFile):
+        try:
+            with open(indexFile) as f:
+                return json.load(f)
+        except ValueError:
+            pass
+
+
+def writeJson(fileName, data):
+    tmpFile = fileName + ".tmp"
+    with open(tmpFile, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmpFile, fileName)
+
+
 class TitleWithDateStamp:
     def __init__(self, title):
         self.title = title + " (generated by " + os.getenv("USER", os.getenv("USERNAME", "unknown")) + " at "
@@ -75,6 +113,85 @@ class TitleWithDateStamp:
         return self.title + plugins.localtime(format="%d%b%H:%M") + ")"
 
 
+class VersionData:
+    def __init__(self, version, repositoryDirInfo, tableHeader, tags, selectors, allSelectors, monthSelectors, stateFiles, successFiles):
+        self.version = version
+        self.repositoryDirInfo = repositoryDirInfo
+        self.tableHeader = tableHeader
+        self.tags = tags
+        self.selectors = selectors
+        self.allSelectors = allSelectors
+        self.monthSelectors = monthSelectors
+        self.stateFiles = stateFiles
+        self.successFiles = successFiles
+
+
+class SpooledTable:
+    """ Renders an HTMLgen.TableLite a row at a time to a temporary file, rather than keeping all rows in memory """
+
+    def __init__(self, **kw):
+        emptyTable = str(HTMLgen.TableLite(**kw))
+        closePos = emptyTable.rindex("</TABLE>")
+        self.opening, self.closing = emptyTable[:closePos], emptyTable[closePos:]
+        self.rowFile = tempfile.TemporaryFile("w+")
+
+    def append(self, row):
+        self.rowFile.write(str(row))
+
+    def writeTo(self, outFile):
+        outFile.write(self.opening)
+        self.rowFile.seek(0)
+        shutil.copyfileobj(self.rowFile, outFile)
+        outFile.write(self.closing)
+        self.rowFile.close()
+
+
+class SpooledContainer:
+    """ Like HTMLgen.Container, but each item is written to a file as soon as it is added """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def append(self, *items):
+        with open(self.fileName, "a") as f:
+            for item in items:
+                if isinstance(item, SpooledTable):
+                    item.writeTo(f)
+                else:
+                    f.write(str(item))
+                f.write("\n")
+
+    def appendContents(self, fileName):
+        # Adds the items of another SpooledContainer, then removes its file
+        with open(self.fileName, "a") as f:
+            with open(fileName) as readFile:
+                shutil.copyfileobj(readFile, f)
+        os.remove(fileName)
+
+
+class SpooledDocument(SpooledContainer):
+    """ An HTMLgen.SimpleDocument whose appended body is spooled to a file. Anything prepended,
+    and attributes such as scripts, stay in the document in memory and are written before the body """
+    documentEnd = "\n</BODY> </HTML>\n"
+
+    def __init__(self, document, fileName):
+        SpooledContainer.__init__(self, fileName)
+        self.document = document
+
+    def prepend(self, *items):
+        self.document.prepend(*items)
+
+    def write(self, fileName):
+        text = str(self.document)
+        with open(fileName, "w") as f:
+            f.write(text[:-len(self.documentEnd)])
+            if os.path.isfile(self.fileName):
+                with open(self.fileName) as readFile:
+                    shutil.copyfileobj(readFile, f)
+                os.remove(self.fileName)
+            f.write(self.documentEnd)
+
+
 class GenerateWebPages(object):
     def __init__(self, getConfigValue, pageDir, resourceNames,
                  pageTitle, pageSubTitles, pageVersion, extraVersions, descriptionInfo):
@@ -88,6 +205,8 @@ class GenerateWebPages(object):
         self.getConfigValue = getConfigValue
         self.resourceNames = resourceNames
         self.descriptionInfo = descriptionInfo
+        self.versionData = []
+        self.spoolDir = None
         self.diag = logging.getLogger("GenerateWebPages")
 
     def makeSelectors(self, subPageNames, tags=[]):
@@ -122,19 +241,91 @@ class GenerateWebPages(object):
                     writeFile.write(line)
 
     def generate(self, repositoryDirs, subPageNames, archiveUnused):
+        allVersionData = self.findVersionData(repositoryDirs, subPageNames, archiveUnused)
+        self.versionData = allVersionData
+        self.spoolDir = tempfile.mkdtemp(prefix="texttest_report_")
+        # Jenkins changes are cached in files shared between versions, don't write them concurrently
+        canFork = not os.getenv("JENKINS_URL")
+        allVersionPages = self.mapInProcesses("generateVersion", list(range(len(allVersionData))), canFork)
+        self.versionData = []
         minorVersionHeader = HTMLgen.Container()
         allMonthSelectors = set()
-        latestMonth = None
         pageToGraphs = {}
+        for versionData, (tables, detailSections) in zip(allVersionData, allVersionPages):
+            allMonthSelectors.update(versionData.monthSelectors)
+            hasData = False
+            for filePath, tableFile, hasNewData, graphLink, tableColours in tables:
+                if filePath in self.pagesOverview:
+                    page, pageColours = self.pagesOverview[filePath]
+                else:
+                    page = self.createPage()
+                    pageColours = {"last_column": set(), "all_columns": set()}
+                    self.pagesOverview[filePath] = page, pageColours
+                page.appendContents(tableFile)
+                hasData |= hasNewData
+                for colourGroupKey in tableColours:
+                    pageColours[colourGroupKey].update(tableColours[colourGroupKey])
+                if graphLink:
+                    pageToGraphs.setdefault(filePath, []).append(graphLink)
+
+            versionToShow = self.removePageVersion(versionData.version)
+            if hasData and versionToShow:
+                link = HTMLgen.Href("#" + versionData.version, versionToShow)
+                minorVersionHeader.append(link)
+
+            for tag, categoryHandler, sectionFile in detailSections:
+                details = self.pagesDetails.get(tag)
+                if details is None:
+                    bodyFile = os.path.join(self.spoolDir, "details" + str(len(self.pagesDetails)))
+                    details = self.pagesDetails[tag] = TestDetails(tag, self.pageTitle, self.pageSubTitles, bodyFile)
+                details.addSpooledVersionSection(categoryHandler, sectionFile)
+
+        selContainer = HTMLgen.Container()
+        selectors = self.makeSelectors(subPageNames)
+        for sel in selectors:
+            target, linkName = sel.getLinkInfo(self.pageVersion)
+            selContainer.append(HTMLgen.Href(target, linkName))
+
+        monthContainer = HTMLgen.Container()
+        if len(allMonthSelectors) == 1:
+            # Don't want just one month, no navigation possible
+            prevMonth = list(allMonthSelectors)[0].getPreviousMonthSelector()
+            allMonthSelectors.add(prevMonth)
+
+        for sel in sorted(allMonthSelectors, key=lambda s: s.sortKey()):
+            target, linkName = sel.getLinkInfo(self.pageVersion)
+            monthContainer.append(HTMLgen.Href(target, linkName))
+
+        for filePath, (page, pageColours) in list(self.pagesOverview.items()):
+            if len(monthContainer.contents) > 0:
+                page.prepend(HTMLgen.Heading(2, monthContainer, align='center'))
+            graphs = pageToGraphs.get(filePath)
+            page.prepend(HTMLgen.Heading(2, selContainer, align='center'))
+            if minorVersionHeader.contents:
+                if not graphs is None and len(graphs) > 1:
+                    page.prepend(HTMLgen.Heading(1, *graphs, align='center'))
+                page.prepend(HTMLgen.Heading(1, minorVersionHeader, align='center'))
+            creationDate = TitleWithDateStamp("").__str__().strip()
+            page.prepend(HTMLgen.Paragraph(creationDate, align="center"))
+            page.prepend(HTMLgen.Heading(1, self.getHeading(), align='center'))
+            if any((len(pageColoursGroup) > 0 for pageColoursGroup in pageColours.values())):
+                page.prepend(HTMLgen.BR())
+                page.prepend(HTMLgen.BR())
+                page.document.script = self.getFilterScripts(pageColours)
+
+        self.writePages()
+
+    def findVersionData(self, repositoryDirs, subPageNames, archiveUnused):
+        allVersionData = []
+        latestMonth = None
         for version, repositoryDirInfo in list(repositoryDirs.items()):
-            self.diag.info("Generating " + version)
+            self.diag.info("Finding results for " + version)
             tagData, stateFiles, successFiles = self.findTestStateFilesAndTags(repositoryDirInfo)
             if len(stateFiles) > 0 or len(successFiles) > 0:
                 tags = list(tagData.keys())
                 tags.sort(key=self.tagSortKey)
                 selectors = self.makeSelectors(subPageNames, tags)
                 monthSelectors = SelectorByMonth.makeInstances(tags)
-                allMonthSelectors.update(monthSelectors)
                 allSelectors = selectors + list(reversed(monthSelectors))
                 # If we already have month pages, we only regenerate the current one
                 if len(self.getExistingMonthPages()) == 0:
@@ -161,111 +352,98 @@ class GenerateWebPages(object):
                             "(To disable automatic repository cleaning in future, please run with the --manualarchive flag when collating the HTML report.)")
                         self.removeUnused(unusedTags, tagData)
 
-                loggedTests = OrderedDict()
-                categoryHandlers = {}
-                self.diag.info("Processing " + str(len(stateFiles)) + " teststate files")
-                relevantFiles = 0
-                for stateFile, repository in stateFiles:
-                    tag = self.getTagFromFile(stateFile)
+                tagSet = set(tags)
+                relevantStateFiles = [(stateFile, repository) for stateFile, repository in stateFiles
+                                      if len(tags) == 0 or self.getTagFromFile(stateFile) in tagSet]
+                tableHeader = self.getTableHeader(version, repositoryDirs)
+                allVersionData.append(VersionData(version, repositoryDirInfo, tableHeader, tags, selectors, allSelectors,
+                                                  monthSelectors, relevantStateFiles, successFiles))
+        return allVersionData
+
+    def getProcessCount(self):
+        processes = self.getConfigValue("historical_report_processes")
+        return processes if processes > 0 else multiprocessing.cpu_count()
+
+    def mapInProcesses(self, methodName, args, canFork=True):
+        # Results come back in the order given, so the pages are merged exactly as they would be serially
+        processes = min(self.getProcessCount(), len(args))
+        if processes > 1 and canFork and "fork" in multiprocessing.get_all_start_methods():
+            self.diag.info("Running " + methodName + " in " + str(processes) + " processes")
+            global forkedGenerator
+            forkedGenerator = self
+            try:
+                with multiprocessing.get_context("fork").Pool(processes) as pool:
+                    chunkSize = max(1, len(args) // (processes * 4))
+                    return pool.map(partial(callForkedGenerator, methodName), args, chunkSize)
+            finally:
+                forkedGenerator = None
+        else:
+            method = getattr(self, methodName)
+            return [method(arg) for arg in args]
+
+    def generateVersion(self, index):
+        # Runs in a worker process when parallel: the HTML is written to files in the spool directory,
+        # ready to be merged into the pages
+        versionData = self.versionData[index]
+        version, tags = versionData.version, versionData.tags
+        self.diag.info("Generating " + version)
+        loggedTests = OrderedDict()
+        categoryHandlers = {}
+        # Read here, so only one version's states are in memory at a time, and worker processes don't send them back
+        self.diag.info("Reading " + str(len(versionData.stateFiles)) + " teststate files")
+        for stateFile, repository in versionData.stateFiles:
+            state = self.readState(stateFile)
+            tag = self.getTagFromFile(stateFile)
+            testId = self.getTestIdentifier(stateFile, repository)
+            extraVersion = self.findExtraVersion(repository)
+            loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(testId, OrderedDict())[tag] = state
+            categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
+                testId, state.category, extraVersion, state)
+        self.diag.info("Processing " + str(len(versionData.successFiles)) + " success files")
+        for successFile, repository in versionData.successFiles:
+            testId = self.getTestIdentifier(successFile, repository)
+            extraVersion = self.findExtraVersion(repository)
+            with open(successFile) as f:
+                fileTags = set()
+                for line in f:
+                    parts = line.strip().split(" ", 1)
+                    if len(parts) != 2:
+                        continue
+                    tag, text = parts
+                    if tag in fileTags:
+                        sys.stderr.write("WARNING: more than one result present for tag '" +
+                                         tag + "' in file " + successFile + "!\n")
+                        sys.stderr.write("Ignoring later ones\n")
+                        continue
+
+                    fileTags.add(tag)
                     if len(tags) == 0 or tag in tags:
-                        relevantFiles += 1
-                        testId, state, extraVersion = self.processTestStateFile(stateFile, repository)
                         loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(
-                            testId, OrderedDict())[tag] = state
+                            testId, OrderedDict())[tag] = text
                         categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
-                            testId, state.category, extraVersion, state)
-                        if relevantFiles % 100 == 0:
-                            self.diag.info("- Processed " + str(relevantFiles) + " files with matching tags so far")
-                self.diag.info("Processed " + str(relevantFiles) + " relevant teststate files")
-                self.diag.info("Processing " + str(len(successFiles)) + " success files")
-                for successFile, repository in successFiles:
-                    testId = self.getTestIdentifier(successFile, repository)
-                    extraVersion = self.findExtraVersion(repository)
-                    with open(successFile) as f:
-                        fileTags = set()
-                        for line in f:
-                            parts = line.strip().split(" ", 1)
-                            if len(parts) != 2:
-                                continue
-                            tag, text = parts
-                            if tag in fileTags:
-                                sys.stderr.write("WARNING: more than one result present for tag '" +
-                                                 tag + "' in file " + successFile + "!\n")
-                                sys.stderr.write("Ignoring later ones\n")
-                                continue
-
-                            fileTags.add(tag)
-                            if len(tags) == 0 or tag in tags:
-                                loggedTests.setdefault(extraVersion, OrderedDict()).setdefault(
-                                    testId, OrderedDict())[tag] = text
-                                categoryHandlers.setdefault(tag, CategoryHandler()).registerInCategory(
-                                    testId, "success", extraVersion, text)
-                self.diag.info("Processed " + str(len(successFiles)) + " success files")
-                versionToShow = self.removePageVersion(version)
-                hasData = False
-                for sel in selectors:
-                    filePath = self.getPageFilePath(sel)
-                    if filePath in self.pagesOverview:
-                        page, pageColours = self.pagesOverview[filePath]
-                    else:
-                        page = self.createPage()
-                        pageColours = {"last_column": set(), "all_columns": set()}
-                        self.pagesOverview[filePath] = page, pageColours
-
-                    tableHeader = self.getTableHeader(version, repositoryDirs)
-                    heading = self.getHeading(versionToShow)
-                    hasNewData, graphLink, tableColours = self.addTable(page, self.resourceNames, categoryHandlers, version,
-                                                                        loggedTests, sel, tableHeader, filePath, heading, repositoryDirInfo)
-                    hasData |= hasNewData
-                    for colourGroupKey in tableColours:
-                        pageColours[colourGroupKey].update(tableColours[colourGroupKey])
-                    if graphLink:
-                        pageToGraphs.setdefault(page, []).append(graphLink)
-
-                if hasData and versionToShow:
-                    link = HTMLgen.Href("#" + version, versionToShow)
-                    minorVersionHeader.append(link)
-
-                # put them in reverse order, most relevant first
-                linkFromDetailsToOverview = [sel.getLinkInfo(self.pageVersion) for sel in allSelectors]
-                for tag in tags:
-                    details = self.pagesDetails.setdefault(tag, TestDetails(tag, self.pageTitle, self.pageSubTitles))
-                    details.addVersionSection(version, categoryHandlers[tag], linkFromDetailsToOverview)
-
-        selContainer = HTMLgen.Container()
-        selectors = self.makeSelectors(subPageNames)
-        for sel in selectors:
-            target, linkName = sel.getLinkInfo(self.pageVersion)
-            selContainer.append(HTMLgen.Href(target, linkName))
-
-        monthContainer = HTMLgen.Container()
-        if len(allMonthSelectors) == 1:
-            # Don't want just one month, no navigation possible
-            prevMonth = list(allMonthSelectors)[0].getPreviousMonthSelector()
-            allMonthSelectors.add(prevMonth)
-
-        for sel in sorted(allMonthSelectors, key=lambda s: s.sortKey()):
-            target, linkName = sel.getLinkInfo(self.pageVersion)
-            monthContainer.append(HTMLgen.Href(target, linkName))
-
-        for page, pageColours in list(self.pagesOverview.values()):
-            if len(monthContainer.contents) > 0:
-                page.prepend(HTMLgen.Heading(2, monthContainer, align='center'))
-            graphs = pageToGraphs.get(page)
-            page.prepend(HTMLgen.Heading(2, selContainer, align='center'))
-            if minorVersionHeader.contents:
-                if not graphs is None and len(graphs) > 1:
-                    page.prepend(HTMLgen.Heading(1, *graphs, align='center'))
-                page.prepend(HTMLgen.Heading(1, minorVersionHeader, align='center'))
-            creationDate = TitleWithDateStamp("").__str__().strip()
-            page.prepend(HTMLgen.Paragraph(creationDate, align="center"))
-            page.prepend(HTMLgen.Heading(1, self.getHeading(), align='center'))
-            if any((len(pageColoursGroup) > 0 for pageColoursGroup in pageColours.values())):
-                page.prepend(HTMLgen.BR())
-                page.prepend(HTMLgen.BR())
-                page.script = self.getFilterScripts(pageColours)
-
-        self.writePages()
+                            testId, "success", extraVersion, text)
+        self.diag.info("Processed " + str(len(versionData.successFiles)) + " success files")
+        versionToShow = self.removePageVersion(version)
+        spoolPrefix = os.path.join(self.spoolDir, "version" + str(index) + "_")
+        tables = []
+        for selIndex, sel in enumerate(versionData.selectors):
+            filePath = self.getPageFilePath(sel)
+            tableFile = spoolPrefix + "table" + str(selIndex)
+            open(tableFile, "w").close()
+            heading = self.getHeading(versionToShow)
+            hasNewData, graphLink, tableColours = self.addTable(SpooledContainer(tableFile), self.resourceNames, categoryHandlers, version,
+                                                                loggedTests, sel, versionData.tableHeader, filePath, heading, versionData.repositoryDirInfo)
+            tables.append((filePath, tableFile, hasNewData, graphLink, tableColours))
+
+        # put them in reverse order, most relevant first
+        linkFromDetailsToOverview = [sel.getLinkInfo(self.pageVersion) for sel in versionData.allSelectors]
+        detailSections = []
+        for tagIndex, tag in enumerate(tags):
+            sectionFile = spoolPrefix + "details" + str(tagIndex)
+            details = TestDetails(tag, self.pageTitle, self.pageSubTitles, sectionFile)
+            details.addVersionSection(version, categoryHandlers[tag], linkFromDetailsToOverview)
+            detailSections.append((tag, categoryHandlers[tag].withoutStates(), sectionFile))
+        return tables, detailSections
 
     def getFilterScripts(self, pageColours):
         finder = ColourFinder(self.getConfigValue)
@@ -331,12 +509,6 @@ class GenerateWebPages(object):
                            str(len(successFiles)) + " success files in " + dir)
         return tagData, stateFiles, successFiles
 
-    def processTestStateFile(self, stateFile, repository):
-        state = self.readState(stateFile)
-        testId = self.getTestIdentifier(stateFile, repository)
-        extraVersion = self.findExtraVersion(repository)
-        return testId, state, extraVersion
-
     def findExtraVersion(self, repository):
         versions = os.path.basename(repository).split(".")
         for i in range(len(versions)):
@@ -378,9 +550,11 @@ class GenerateWebPages(object):
         return os.path.join(self.pageDir, pageName)
 
     def createPage(self):
+        bodyFile = os.path.join(self.spoolDir, "overview" + str(len(self.pagesOverview)))
         style = "body,td {color: #000000;font-size: 11px;font-family: Helvetica;} th {color: #000000;font-size: 13px;font-family: Helvetica;}"
         title = "Test results for " + self.pageTitle
-        return HTMLgen.SimpleDocument(title=title, style=style, xhtml=True, meta='<meta charset="' + locale.getpreferredencoding() + '">')
+        document = HTMLgen.SimpleDocument(title=title, style=style, xhtml=True, meta='<meta charset="' + locale.getpreferredencoding() + '">')
+        return SpooledDocument(document, bodyFile)
 
     def makeTableHeaderCell(self, tableHeader):
         container = HTMLgen.Container()
@@ -448,8 +622,30 @@ class GenerateWebPages(object):
             pageName = getDetailPageName(self.pageVersion, tag)
             details.write(os.path.join(self.pageDir, pageName))
             plugins.log.info("wrote: '" + pageName + "'")
+        self.writeSummaryIndex()
         if self.includeCommentPlugin():
             self.writeCommentListPage()
+        shutil.rmtree(self.spoolDir, ignore_errors=True)
+
+    def writeSummaryIndex(self):
+        # Other page versions may share the directory, so keep their pages, unless they have been removed
+        index = readSummaryIndex(self.pageDir)
+        if index is None:
+            # First index in this directory: pages written before there was one must not be lost
+            index = {}
+            pageNames = set((os.path.basename(f) for f in glob(os.path.join(self.pageDir, "test_*.html"))))
+        else:
+            pageNames = set(index.get("pages", []))
+        pageNames.update((getDetailPageName(self.pageVersion, tag) for tag in self.pagesDetails))
+        existingPages = [pageName for pageName in pageNames if os.path.isfile(os.path.join(self.pageDir, pageName))]
+        index["application"] = self.getApplicationName()
+        index["pages"] = sorted(existingPages)
+        writeJson(getSummaryIndexFile(self.pageDir), index)
+
+    def getApplicationName(self):
+        # Same as what the summary page used to deduce from the page titles
+        if " - " in self.pageTitle:
+            return self.pageTitle.split(" - ")[0]
 
     def writeCommentListPage(self):
         filename = os.path.join(self.pageDir, "commentlist.html")
@@ -497,7 +693,8 @@ class TestTable:
             return False
 
     def generate(self, loggedTests, pageDir, repositoryDirs):
-        table = HTMLgen.TableLite(border=0, cellpadding=4, cellspacing=2, width="100%")
+        # Rows are written out as they're generated, the table can be too big to keep in memory
+        table = SpooledTable(border=0, cellpadding=4, cellspacing=2, width="100%")
         table.append(self.generateTableHead(repositoryDirs))
         table.append(self.generateSummaries())
         if os.getenv("JENKINS_URL"):
@@ -506,28 +703,20 @@ class TestTable:
                 table.append(changeRow)
         hasRows = False
         for extraVersion, testInfo in list(loggedTests.items()):
-            currRows = []
+            hasVersionRows = False
             for test in sorted(testInfo.keys()):
                 results = testInfo[test]
-                rows = self.generateTestRows(test, extraVersion, results)
-                if rows:
-                    currRows += rows
-
-            if len(currRows) == 0:
-                continue
-            else:
-                hasRows = True
-
-            # Add an extra line in the table only if there are several versions.
-            if len(loggedTests) > 1:
-                fullVersion = self.version
-                if extraVersion:
-                    fullVersion += "." + extraVersion
-                table.append(self.generateExtraVersionHeader(fullVersion))
-                table.append(self.generateSummaries(extraVersion))
-
-            for row in currRows:
-                table.append(row)
+                for row in self.generateTestRows(test, extraVersion, results) or []:
+                    # Add an extra line in the table only if there are several versions.
+                    if not hasVersionRows and len(loggedTests) > 1:
+                        fullVersion = self.version
+                        if extraVersion:
+                            fullVersion += "." + extraVersion
+                        table.append(self.generateExtraVersionHeader(fullVersion))
+                        table.append(self.generateSummaries(extraVersion))
+                    hasVersionRows = True
+                    table.append(row)
+            hasRows |= hasVersionRows
 
         if hasRows:
             table.append(HTMLgen.BR())
@@ -808,41 +997,51 @@ class TestTable:
 
 
 class TestDetails:
-    def __init__(self, tag, pageTitle, pageSubTitles):
+    def __init__(self, tag, pageTitle, pageSubTitles, bodyFile):
         tagText = getDisplayText(tag)
         pageDetailTitle = "Detailed test results for " + pageTitle + ": " + tagText
-        self.document = HTMLgen.SimpleDocument(title=TitleWithDateStamp(pageDetailTitle), meta='<meta charset="' + locale.getpreferredencoding() + '">')
+        document = HTMLgen.SimpleDocument(title=TitleWithDateStamp(pageDetailTitle), meta='<meta charset="' + locale.getpreferredencoding() + '">')
         headerText = tagText + " - detailed test results for " + pageTitle
-        self.document.append(HTMLgen.Heading(1, headerText, align='center'))
+        document.append(HTMLgen.Heading(1, headerText, align='center'))
         for subTitle, command in pageSubTitles:
-            self.document.append(HTMLgen.Center(HTMLgen.Emphasis(subTitle)))
-            self.document.append(HTMLgen.Center(HTMLgen.Paragraph(command, style='font-family:monospace')))
+            document.append(HTMLgen.Center(HTMLgen.Emphasis(subTitle)))
+            document.append(HTMLgen.Center(HTMLgen.Paragraph(command, style='font-family:monospace')))
+        # The version sections are spooled to bodyFile, only the headings stay in memory
+        self.page = SpooledDocument(document, bodyFile)
         self.totalCategoryHandler = CategoryHandler()
-        self.versionSections = []
+        self.sectionCount = 0
 
     def addVersionSection(self, version, categoryHandler, linkFromDetailsToOverview):
         self.totalCategoryHandler.update(categoryHandler)
-        container = HTMLgen.Container()
-        container.append(HTMLgen.HR())
-        container.append(self.getSummaryHeading(version, categoryHandler))
+        self.sectionCount += 1
+        self.page.append(HTMLgen.HR(), self.getSummaryHeading(version, categoryHandler))
         for desc, testInfo in categoryHandler.getTestsWithDescriptions():
             fullDescription = self.getFullDescription(testInfo, version, linkFromDetailsToOverview)
             if fullDescription:
-                container.append(HTMLgen.Name(version + desc))
-                container.append(HTMLgen.Heading(3, "Detailed information for the tests that " + desc + ":"))
-                container.append(fullDescription)
-        self.versionSections.append(container)
+                self.page.append(HTMLgen.Name(version + desc),
+                                 HTMLgen.Heading(3, "Detailed information for the tests that " + desc + ":"),
+                                 fullDescription)
+        # End the section with an empty line, as when each section was a Container in the document
+        self.page.append("")
+
+    def addSpooledVersionSection(self, categoryHandler, sectionFile):
+        self.totalCategoryHandler.update(categoryHandler)
+        self.sectionCount += 1
+        self.page.appendContents(sectionFile)
 
     def getSummaryHeading(self, version, categoryHandler):
         return HTMLgen.Heading(2, version + ": " + categoryHandler.generateTextSummary())
 
     def write(self, fileName):
-        if len(self.versionSections) > 1:
-            self.document.append(self.getSummaryHeading("Total", self.totalCategoryHandler))
-        for sect in self.versionSections:
-            self.document.append(sect)
-        self.versionSections = []  # In case we get called again
-        self.document.write(fileName)
+        if self.sectionCount > 1:
+            self.page.document.append(self.getSummaryHeading("Total", self.totalCategoryHandler))
+        self.page.write(fileName)
+        self.writeSummarySidecar(fileName)
+
+    def writeSummarySidecar(self, fileName):
+        _, summaryData = self.totalCategoryHandler.getSummaryData()
+        categories = [(getCategoryDescription(cat)[0], count) for cat, count in summaryData]
+        writeJson(getSummarySidecarFile(fileName), {"categories": categories})
 
     def getFreeTextData(self, tests):
         data = OrderedDict()
@@ -928,6 +1127,13 @@ class CategoryHandler:
             testInfoList = self.testsInCategory.setdefault(category, [])
             testInfoList += testInfo
 
+    def withoutStates(self):
+        # Summaries only need the counts, and states are expensive to send between processes
+        handler = CategoryHandler()
+        for category, testInfo in list(self.testsInCategory.items()):
+            handler.testsInCategory[category] = [(testId, None, extraVersion) for testId, _, extraVersion in testInfo]
+        return handler
+
     def registerInCategory(self, testId, category, extraVersion, state):
         self.testsInCategory.setdefault(category, []).append((testId, state, extraVersion))
 
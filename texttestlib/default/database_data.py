@@ -1,5 +1,5 @@
 
-import os, shutil
+import os, shutil, hashlib
 from texttestlib import plugins
 
 class SaveDatabase(plugins.Action):
@@ -16,6 +16,7 @@ class SaveDatabase(plugins.Action):
             shutil.copytree(tmpDir, dstDir)
 
     def mergeDirs(self, src, dst):
+        # Only rewrite tables that have changed, so saving is proportional to the change rather than the database size
         for srcRoot, dirs, files in os.walk(src):
             dstRoot = srcRoot.replace(src, dst)
             for d in dirs:
@@ -25,12 +26,28 @@ class SaveDatabase(plugins.Action):
             for f in files:
                 dstFile = os.path.join(dstRoot, f)
                 srcFile = os.path.join(srcRoot, f)
-                if os.path.isfile(dstFile):
+                if not os.path.isfile(dstFile) or not self.filesIdentical(srcFile, dstFile):
                     # if PrepareWriteDirectoryMergeTables.is_db_table_addition(dstFile) and \
                     #    PrepareWriteDirectoryMergeTables.is_db_table_addition(srcFile):
                     #     with open(dstFile, "a") as f:
                     #         f.write(open(srcFile).read())
                     #     continue
                     # else:
-                    os.remove(dstFile)
-                shutil.copyfile(srcFile, dstFile)
\ No newline at end of file
+                    self.replaceFile(srcFile, dstFile)
+
+    def filesIdentical(self, file1, file2):
+        if os.path.getsize(file1) != os.path.getsize(file2):
+            return False
+        return self.getContentHash(file1) == self.getContentHash(file2)
+
+    def getContentHash(self, fileName):
+        md5 = hashlib.md5()
+        with open(fileName, "rb") as f:
+            for block in iter(lambda: f.read(65536), b""):
+                md5.update(block)
+        return md5.digest()
+
+    def replaceFile(self, srcFile, dstFile):
+        tmpFile = dstFile + ".tmp"
+        shutil.copyfile(srcFile, tmpFile)
+        os.replace(tmpFile, dstFile)
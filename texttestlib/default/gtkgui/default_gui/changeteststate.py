@@ -12,6 +12,7 @@ from configparser import ConfigParser
 from copy import copy
 from glob import glob
 from threading import Thread
+from multiprocessing.pool import ThreadPool
 
 
 class BackgroundThreadHelper:
@@ -40,6 +41,20 @@ class BackgroundThreadHelper:
         self.notify("ActionStop", False)
         self.notify("BackgroundActionCompleted", errorMsg, self)
 
+    def performOnTests(self, method, tests):
+        # Each test's files are separate, so several tests can be waiting for the disk at once
+        threadCount = min(len(tests), guiplugins.guiConfig.getValue("gui_background_threads"))
+        if threadCount <= 1:
+            for test in tests:
+                method(test)
+        else:
+            pool = ThreadPool(threadCount)
+            try:
+                pool.map(method, tests, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
     def _runInteractive(self):
         guiplugins.ActionGUI._runInteractive(self)
         self.performInBackground()
@@ -181,17 +196,20 @@ class ApproveTests(BackgroundThreadHelper, guiplugins.ActionDialogGUI):
         # Calculate the versions beforehand, as approving tests can change the selection,
         # which can affect the default version calculation...
         testsWithVersions = [(test, self.getVersion(test)) for test in tests]
+        versions = dict(testsWithVersions)
+        exact = self.getExactness()
         testDesc = str(len(tests)) + " tests"
         self.notify("Status", "Approving " + testDesc + " ...")
-        try:
-            for test, versionString in testsWithVersions:
-                testComparison = test.stateInGui
-                testComparison.setObservers(self.observers)
-                testComparison.save(test, self.getExactness(), versionString,
-                                    overwriteSuccess, stemsToApprove, backupVersions)
-                newState = testComparison.makeNewState(test, "approved")
-                test.changeState(newState)
 
+        def approveTest(test):
+            testComparison = test.stateInGui
+            testComparison.setObservers(self.observers)
+            testComparison.save(test, exact, versions[test], overwriteSuccess, stemsToApprove, backupVersions)
+            newState = testComparison.makeNewState(test, "approved")
+            test.changeState(newState)
+
+        try:
+            self.performOnTests(approveTest, tests)
             self.notify("Status", "Approved " + testDesc + ".")
         except OSError as e:
             self.notify("Status", "Failed to approve " + testDesc + ".")
@@ -280,14 +298,13 @@ class RecomputeTests(BackgroundThreadHelper, guiplugins.ActionGUI):
             self.reloadConfigForSelected()
 
     def performBackgroundAction(self, selection):
-        latestTestCount = 0
-        for test in selection:
-            latestTestCount += 1
-            self.notify("Status", "Recomputing status of " + repr(test) + " ...")
-            test.app.recomputeProgress(test, test.stateInGui, self.observers)
-            self.notify("Recomputed", test)
-
-        self.notify("Status", self.getFinalMessage(latestTestCount))
+        self.performOnTests(self.recomputeTest, selection)
+        self.notify("Status", self.getFinalMessage(len(selection)))
+
+    def recomputeTest(self, test):
+        self.notify("Status", "Recomputing status of " + repr(test) + " ...")
+        test.app.recomputeProgress(test, test.stateInGui, self.observers)
+        self.notify("Recomputed", test)
 
     def getFinalMessage(self, latestTestCount):
         if latestTestCount == 0:
@@ -191,6 +191,8 @@ class GUIConfig:
                               "Add these completions to the entry completion lists initially")
         self.setConfigDefault("sort_test_suites_recursively", 1, "Sort subsuites when sorting test suites")
         self.setConfigDefault("retro_icons", 0, "Use the old TextTest icons in the dynamic and static GUIs")
+        self.setConfigDefault("gui_background_threads", 4,
+                              "How many tests to approve or recompute at the same time in the dynamic GUI")
 
     def setConfigDefault(self, key, value, docString):
         self.configDir[key] = value
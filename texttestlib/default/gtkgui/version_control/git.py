@@ -44,6 +44,27 @@ class GitInterface(vcs_independent.VersionControlInterface):
         else:
             return "Unchanged"
 
+    def getTreeStatus(self, fileArg, fileNames, **kwargs):
+        relPaths = [self.makeRelPath(f) for f in fileNames]
+        if any((os.path.isabs(relPath) for relPath in relPaths)):
+            return None
+        # -z avoids quoting of file names. We need untracked files individually, not just their directories
+        args = self.getCmdArgs("status", ["-z", "--untracked-files=all", fileArg])
+        retcode, stdout, _ = self.getProcessResults(args, **kwargs)
+        if retcode:
+            return None
+        outputs = {}
+        entries = iter(stdout.split("\0"))
+        for entry in entries:
+            if entry:
+                statusLetters, relPath = entry[:2], entry[3:]
+                if "R" in statusLetters or "C" in statusLetters:
+                    next(entries, None)  # the name it was renamed or copied from
+                # Paths are relative to the repository root, as in the output for a single file
+                outputs[relPath] = statusLetters + " " + relPath + "\n"
+        # Anything not mentioned is unchanged, and produces no output
+        return {f: outputs.get(relPath, "") for f, relPath in zip(fileNames, relPaths)}
+
     def getFileNames(self, fileArg, recursive, forStatus=False, **kwargs):
         # Git handles ignored files different. We have to remove all ignored files to avoid doing status on them
         fileNames = vcs_independent.VersionControlInterface.getFileNames(self, fileArg, recursive, **kwargs)
@@ -46,10 +46,21 @@ class HgInterface(vcs_independent.VersionControlInterface):
         else:
             return os.path.realpath(file)
 
-    def callProgramOnFiles(self, cmdName, fileArg, recursive=False, extraArgs=[], **kwargs):
-        basicArgs = self.getCmdArgs(cmdName, extraArgs)
-        for fileName in self.getFileNamesForCmd(cmdName, fileArg, recursive):
-            self.callProgramWithHandler(fileName, basicArgs + [self.correctForLinks(fileName)], **kwargs)
+    def getFileArgForCmd(self, fileName):
+        return self.correctForLinks(fileName)
+
+    def getTreeStatus(self, fileArg, fileNames, **kwargs):
+        if not os.path.isdir(fileArg):
+            return None
+        # Given a pattern, Mercurial reports paths relative to the working directory
+        realDir = os.path.realpath(fileArg)
+        retcode, stdout, stderr = self.getProcessResults(self.getCmdArgs("status", ["."]), cwd=realDir)
+        if retcode or stderr:
+            return None
+        outputs = {}
+        for line in stdout.splitlines():
+            outputs[os.path.join(realDir, os.path.normpath(line[2:]))] = line + "\n"
+        return {f: outputs.get(self.correctForLinks(f), "") for f in fileNames}
 
     def getStateFromStatus(self, output):
         words = output.split()
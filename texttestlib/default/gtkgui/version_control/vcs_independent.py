@@ -31,13 +31,23 @@ class VersionControlInterface:
         self.callProgram("help")  # throws if it's not installed
 
     def isVersionControlled(self, path):
+        fileNames = self.getFileNames(path, recursive=True, forStatus=True)
+        treeStatus = self.getTreeStatus(path, fileNames) if len(fileNames) > 1 else None
         basicArgs = self.getCmdArgs("status")
-        for file in self.getFileNames(path, recursive=True, forStatus=True):
-            status = self.getFileStatus(basicArgs, file)
+        for file in fileNames:
+            if treeStatus is not None:
+                status = self.getStateFromStatus(treeStatus[file])
+            else:
+                status = self.getFileStatus(basicArgs, file)
             if status != "Unknown" and status != "Ignored":
                 return True
         return False
 
+    def getTreeStatus(self, fileArg, fileNames, **kwargs):
+        # Return the status output for each of fileNames from a single call on fileArg.
+        # None means this VCS can't do that, and we ask about each file separately
+        return None
+
     def getFileStatus(self, basicArgs, file):
         output = self.getProcessResults(basicArgs + [file])[1]
         return self.getStateFromStatus(output)
@@ -47,9 +57,25 @@ class VersionControlInterface:
                                stdout=open(os.devnull, "w"), stderr=open(os.devnull, "w"), **kwargs)
 
     def callProgramOnFiles(self, cmdName, fileArg, recursive=False, extraArgs=[], **kwargs):
+        fileNames = self.getFileNamesForCmd(cmdName, fileArg, recursive)
+        if cmdName == "status" and not extraArgs and len(fileNames) > 1 and \
+                self.callStatusOnTree(fileArg, fileNames, **kwargs):
+            return
         basicArgs = self.getCmdArgs(cmdName, extraArgs)
-        for fileName in self.getFileNamesForCmd(cmdName, fileArg, recursive):
-            self.callProgramWithHandler(fileName, basicArgs + [fileName], **kwargs)
+        for fileName in fileNames:
+            self.callProgramWithHandler(fileName, basicArgs + [self.getFileArgForCmd(fileName)], **kwargs)
+
+    def callStatusOnTree(self, fileArg, fileNames, outputHandler=None, outputHandlerArgs=(), **kwargs):
+        treeStatus = self.getTreeStatus(fileArg, fileNames, **kwargs)
+        if treeStatus is None:
+            return False
+        if outputHandler:
+            for fileName in fileNames:
+                outputHandler(0, treeStatus[fileName], "", fileName, *outputHandlerArgs)
+        return True
+
+    def getFileArgForCmd(self, fileName):
+        return fileName
 
     def callProgramWithHandler(self, fileName, args, outputHandler=None, outputHandlerArgs=(), **kwargs):
         retcode, stdout, stderr = self.getProcessResults(args, **kwargs)
@@ -5,6 +5,9 @@ import sys
 import logging
 import glob
 import re
+import json
+import time
+from threading import Lock
 from texttestlib import plugins
 from configparser import ConfigParser, NoOptionError
 from copy import copy
@@ -65,7 +68,9 @@ class BugSystemBug(Bug):
         location = test.getCompositeConfigValue("bug_system_location", self.bugSystem)
         username = test.getCompositeConfigValue("bug_system_username", self.bugSystem)
         password = test.getCompositeConfigValue("bug_system_password", self.bugSystem)
-        status, bugText, isResolved, bugId = self.findBugInfo(self.bugId, location, username, password)
+        timeToLive = test.getCompositeConfigValue("bug_system_cache_ttl", self.bugSystem)
+        key = self.bugSystem, location, self.bugId
+        status, bugText, isResolved, bugId = BugInfoCache.getInfo(key, timeToLive, self.findBugInfo, self.bugId, location, username, password)
         self.bugId = bugId
         category = self.findCategory(isResolved)
         briefText = "bug " + self.bugId + " (" + status + ")"
@@ -79,6 +84,76 @@ class BugSystemBug(Bug):
         except ImportError:
             return "unknown", "Bug " + bugId + " in unknown bug system '" + self.bugSystem + "'", False, bugId
 
+
+class BugInfoCache:
+    """ Information already fetched from bug systems, keyed on bug system, location and bug ID.
+    Kept for the whole run, and also on disk for bug_system_cache_ttl seconds if that is set """
+    lock = Lock()
+    infoInRun = {}
+    infoOnDisk = None
+    # Failed lookups are only remembered for this run, not on disk
+    errorStatuses = ["unknown", "NONEXISTENT", "BAD SCRIPT", "PARSE ERROR", "PAT not set"]
+
+    @classmethod
+    def getInfo(cls, key, timeToLive, fetchMethod, *args):
+        with cls.lock:
+            info = cls.infoInRun.get(key) or cls.readFromDisk(key, timeToLive)
+        if info is None:
+            info = fetchMethod(*args)
+            with cls.lock:
+                cls.infoInRun[key] = info
+                if timeToLive > 0 and not cls.isError(info[0]):
+                    cls.writeToDisk(key, info)
+        return info
+
+    @classmethod
+    def isError(cls, status):
+        return status in cls.errorStatuses or status.endswith("ERROR")
+
+    @staticmethod
+    def getFileName():
+        return os.path.join(plugins.getPersonalDir("cache"), "bug_info.json")
+
+    @staticmethod
+    def getDiskKey(key):
+        return "\t".join(key)
+
+    @classmethod
+    def readFromDisk(cls, key, timeToLive):
+        if timeToLive <= 0:
+            return
+        if cls.infoOnDisk is None:
+            cls.infoOnDisk = cls.readFile()
+        entry = cls.infoOnDisk.get(cls.getDiskKey(key))
+        if entry and time.time() - entry["time"] < timeToLive:
+            info = tuple(entry["info"])
+            cls.infoInRun[key] = info
+            return info
+
+    @classmethod
+    def readFile(cls):
+        try:
+            with open(cls.getFileName()) as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError):
+            return {}
+
+    @classmethod
+    def writeToDisk(cls, key, info):
+        # Other runs may have added to the file since we read it
+        cls.infoOnDisk = cls.readFile()
+        cls.infoOnDisk[cls.getDiskKey(key)] = {"time": time.time(), "info": list(info)}
+        fileName = cls.getFileName()
+        tmpFileName = fileName + "." + str(os.getpid())
+        try:
+            plugins.ensureDirExistsForFile(fileName)
+            with open(tmpFileName, "w") as f:
+                json.dump(cls.infoOnDisk, f)
+            os.replace(tmpFileName, fileName)
+        except EnvironmentError:
+            plugins.printWarning("Could not write bug information cache at " + fileName)
+
+
 class UnreportedBug(Bug):
     def __init__(self, fullText, briefText, internalError, priorityStr, *args):
         self.fullText = fullText
@@ -106,6 +181,9 @@ class UnreportedBug(Bug):
 
 
 class BugTrigger:
+    # Back references and inline flags mean something else once combined with other patterns
+    uncombinablePattern = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]")
+
     def __init__(self, getOption):
         useRegexp = int(getOption("use_regexp", "1"))
         searchStr = getOption("search_string").replace("\\n", "\n")
@@ -158,13 +236,31 @@ class BugTrigger:
         module, method = self.customTrigger.split(".", 1)
         return plugins.importAndCall(module, method, *args)
 
-    def hasBug(self, line, execHosts=[], isChanged=True, multipleDiffs=False, tmpDir=None):
+    def getFirstLinePattern(self):
+        # For combining with other triggers: None if this can't be done safely.
+        # Multiline triggers that have started matching need to see every line
+        if len(self.textTrigger.triggers) != 1:
+            return None
+        firstTrigger = self.textTrigger.triggers[0]
+        if firstTrigger.regex is None:
+            return re.escape(firstTrigger.text)
+        elif self.uncombinablePattern.search(firstTrigger.text):
+            return None
+        else:
+            return firstTrigger.text
+
+    def canTrigger(self, isChanged=True, multipleDiffs=False, **kw):
         if not self.checkUnchanged and not isChanged:
             self.diag.info("File not changed, ignoring")
             return False
         if multipleDiffs and not self.ignoreOtherErrors:
             self.diag.info("Multiple differences present, allowing others through")
             return False
+        return True
+
+    def hasBug(self, line, execHosts=[], isChanged=True, multipleDiffs=False, tmpDir=None):
+        if not self.canTrigger(isChanged, multipleDiffs):
+            return False
         if line is not None and not self.textTrigger.matches(line):
             return False
 
@@ -212,9 +308,12 @@ class FileBugData:
         self.absentList = []
         self.identicalList = []
         self.checkUnchanged = False
+        self.prefilter = None
+        self.unfilteredTriggers = set()
         self.diag = logging.getLogger("Check For Bugs")
 
     def addBugTrigger(self, getOption):
+        self.prefilter = None
         bugTrigger = BugTrigger(getOption)
         if bugTrigger.checkUnchanged:
             self.checkUnchanged = True
@@ -238,7 +337,10 @@ class FileBugData:
 
         self.diag.info("Looking for bugs in " + fileName)
         dirname = os.path.dirname(fileName)
-        return self.findBugsInText(open(fileName).readlines(), execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
+        with open(fileName) as f:
+            # Only triggers on identical files need all the lines at once
+            lines = f.readlines() if self.identicalList else f
+            return self.findBugsInText(lines, execHosts=execHosts, isChanged=isChanged, multipleDiffs=multipleDiffs, tmpDir=dirname)
 
     def findBugsInText(self, lines, **kw):
         currAbsent = copy(self.absentList)
@@ -246,24 +348,53 @@ class FileBugData:
         for bugTrigger in self.identicalList:
             if bugTrigger not in bugs and bugTrigger.exactMatch(lines, **kw):
                 bugs.append(bugTrigger)
+        # These checks don't depend on the line, so there's no point asking them for every line
+        currPresent = [t for t in self.presentList if t.canTrigger(**kw)]
+        prefilter = self.getPrefilter()
+        debug = self.diag.isEnabledFor(logging.INFO)
         for line in lines:
-            self.diag.info("Checking " + repr(line))
-            for bugTrigger in self.presentList:
-                self.diag.info("Checking for existence of " + repr(bugTrigger))
+            if prefilter.search(line):
+                presentToCheck, absentToCheck = currPresent, currAbsent
+            else:
+                # Only triggers the prefilter doesn't cover can match this line
+                presentToCheck = [t for t in currPresent if t in self.unfilteredTriggers]
+                absentToCheck = [t for t in currAbsent if t in self.unfilteredTriggers]
+                if not presentToCheck and not absentToCheck:
+                    continue
+            if debug:
+                self.diag.info("Checking " + repr(line))
+            for bugTrigger in presentToCheck:
                 if bugTrigger not in bugs and bugTrigger.hasBug(line, **kw):
-                    self.diag.info("FOUND!")
+                    self.diag.info("FOUND " + repr(bugTrigger))
                     bugs.append(bugTrigger)
             toRemove = []
-            for bugTrigger in currAbsent:
-                self.diag.info("Checking for absence of " + repr(bugTrigger))
+            for bugTrigger in absentToCheck:
                 if bugTrigger.matchesText(line):
-                    self.diag.info("PRESENT!")
+                    self.diag.info("PRESENT " + repr(bugTrigger))
                     toRemove.append(bugTrigger)
             for bugTrigger in toRemove:
                 currAbsent.remove(bugTrigger)
 
         return bugs + self.findAbsenceBugs(currAbsent, **kw)
 
+    def getPrefilter(self):
+        # One regular expression matching any line where some trigger could start to match.
+        # Most lines match nothing, and can then be skipped without asking each trigger
+        if self.prefilter is None:
+            patterns = []
+            self.unfilteredTriggers = set()
+            for bugTrigger in self.presentList + self.absentList:
+                pattern = bugTrigger.getFirstLinePattern()
+                if pattern is None:
+                    self.unfilteredTriggers.add(bugTrigger)
+                else:
+                    patterns.append(pattern)
+            try:
+                self.prefilter = re.compile("|".join("(?:" + p + ")" for p in patterns)) if patterns else re.compile("(?!)")
+            except re.error:
+                self.prefilter = re.compile("")
+        return self.prefilter
+
     def findAbsenceBugs(self, absentList, **kw):
         bugs = []
         for bugTrigger in absentList:
@@ -1,13 +1,13 @@
 
 import os
 import sys
+import re
 import time
+import math
 from texttestlib import plugins
 from .comparefile import FileComparison
 
 
-from functools import cmp_to_key
-
 # This module won't work without an external module creating a file called performance.app
 # This file should be of a format understood by the function below i.e. a single line containing
 # CPU time   :      30.31 sec. on heathlands
@@ -38,6 +38,16 @@ def getPerformanceFromLine(line):
     return float(line[pos + 1:].lstrip().split()[0])
 
 
+def getBenchmarkStatistics(fileName):
+    # Written by MakePerformanceFile when running with -bench
+    with open(fileName) as f:
+        for line in f:
+            match = re.match(r"Benchmark\s*:\s*(\d+) runs, min (\S+), median (\S+), stddev ([0-9.]+)", line)
+            if match:
+                return {"runs": int(match.group(1)), "min": float(match.group(2).rstrip(",")),
+                        "median": float(match.group(3).rstrip(",")), "stddev": float(match.group(4))}
+
+
 def getTestPerformance(test, version=None):
     try:
         perfStem = test.getConfigValue("default_performance_stem")
@@ -47,12 +57,96 @@ def getTestPerformance(test, version=None):
         if test.app.hasFileCache:
             return getPerformanceFromCache(fileName, test.app.fileCache)
         else:
-            return getPerformance(fileName)
+            return PerformanceIndex.getInstance(test.app).getPerformance(fileName)
     except IOError:  # assume something disappeared externally
         test.refreshFiles()
         return getTestPerformance(test, version)
 
 
+def getTestPerformances(tests, version=None):
+    return {test: getTestPerformance(test, version) for test in tests}
+
+
+class PerformanceIndex:
+    """ The values in each application's performance files, so they only need to be parsed again
+    if the file has changed. Filtering on performance otherwise reads every file on every selection """
+    instances = {}
+
+    @classmethod
+    def getInstance(cls, app):
+        if app not in cls.instances:
+            cls.instances[app] = cls()
+        return cls.instances[app]
+
+    def __init__(self):
+        self.entries = {}
+
+    def getPerformance(self, fileName):
+        stat = os.stat(fileName)
+        key = stat.st_mtime_ns, stat.st_size
+        entry = self.entries.get(fileName)
+        if entry is None or entry[0] != key:
+            entry = key, getPerformance(fileName)
+            self.entries[fileName] = entry
+        return entry[1]
+
+
+def getPerformanceHistoryFile(test, stem):
+    repository = test.app.getBatchConfigValue("batch_result_repository")
+    if repository:
+        version = test.app.getFullVersion() or "default"
+        return os.path.join(os.path.expanduser(repository), test.app.name, "performance_history",
+                            version, test.getRelPath(), stem)
+
+
+def recordPerformanceHistory(test, runName):
+    # Called when saving batch results: remember the new values for comparing future runs with
+    for comparison in getattr(test.state, "allResults", []):
+        if isinstance(comparison, PerformanceFileComparison) and comparison.tmpFile and os.path.isfile(comparison.tmpFile):
+            settings = PerformanceConfigSettings(test, comparison.stem)
+            maxSamples = settings.getHistorySize()
+            fileName = getPerformanceHistoryFile(test, comparison.stem)
+            if maxSamples > 0 and fileName:
+                PerformanceHistory(fileName, maxSamples).addSample(runName, getPerformance(comparison.tmpFile))
+
+
+class PerformanceHistory:
+    """ Rolling record of the most recent performance values for a test, one line per run """
+    def __init__(self, fileName, maxSamples):
+        self.fileName = fileName
+        self.maxSamples = maxSamples
+
+    def readLines(self):
+        if os.path.isfile(self.fileName):
+            with open(self.fileName) as f:
+                return [line for line in f if line.strip()]
+        else:
+            return []
+
+    def getSamples(self):
+        samples = []
+        for line in self.readLines()[-self.maxSamples:]:
+            try:
+                samples.append(float(line.split()[-1]))
+            except ValueError:
+                pass  # ignore anything we don't understand
+        return samples
+
+    def addSample(self, runName, value):
+        if value < 0:
+            return
+        lines = self.readLines()[-(self.maxSamples - 1):] if self.maxSamples > 1 else []
+        lines.append(runName + " " + str(value) + "\n")
+        try:
+            plugins.ensureDirExistsForFile(self.fileName)
+            tmpFileName = self.fileName + ".tmp"
+            with open(tmpFileName, "w") as f:
+                f.writelines(lines)
+            os.replace(tmpFileName, self.fileName)
+        except EnvironmentError:
+            plugins.printWarning("Could not write performance history at " + self.fileName)
+
+
 def describePerformance(fileName):
     line = open(fileName).readline().strip()
     if "mem" in os.path.basename(fileName):
@@ -140,6 +234,12 @@ class PerformanceConfigSettings:
     def ignoreImprovements(self):
         return self.configMethod("performance_ignore_improvements", self.configName) == "true"
 
+    def getHistorySize(self):
+        return self.configMethod("performance_history_samples", self.configName)
+
+    def getHistoryThreshold(self):
+        return self.configMethod("performance_history_threshold", self.configName)
+
     def _getDescriptor(self, configEntry, configName):
         fromConfig = self.configMethod(configEntry, configName)
         if len(fromConfig) > 0:
@@ -169,9 +269,27 @@ class PerformanceFileComparison(FileComparison):
             newPerf = getPerformance(self.tmpFile)
             self.diag.info("Performance is " + str(oldPerf) + " and " + str(newPerf))
             settings = PerformanceConfigSettings(test, self.stem)
-            self.perfComparison = PerformanceComparison(oldPerf, newPerf, settings)
+            oldStats, newStats = getBenchmarkStatistics(self.stdFile), getBenchmarkStatistics(self.tmpFile)
+            if oldStats and newStats:
+                self.diag.info("Comparing benchmark statistics " + repr(oldStats) + " and " + repr(newStats))
+                self.perfComparison = BenchmarkPerformanceComparison(oldStats, newStats, settings)
+            else:
+                samples = self.getHistorySamples(test, settings)
+                if len(samples) >= HistoricalPerformanceComparison.minimumSamples:
+                    self.diag.info("Comparing with " + str(len(samples)) + " historical samples")
+                    self.perfComparison = HistoricalPerformanceComparison(oldPerf, newPerf, settings, samples)
+                else:
+                    self.perfComparison = PerformanceComparison(oldPerf, newPerf, settings)
             self.differenceCache = self.perfComparison.isSignificant(settings)
 
+    def getHistorySamples(self, test, settings):
+        maxSamples = settings.getHistorySize()
+        fileName = getPerformanceHistoryFile(test, self.stem) if maxSamples > 0 else None
+        if fileName:
+            return PerformanceHistory(fileName, maxSamples).getSamples()
+        else:
+            return []
+
     def __repr__(self):
         baseText = FileComparison.__repr__(self)
         if self.newResult():
@@ -204,14 +322,27 @@ class PerformanceFileComparison(FileComparison):
             return getPerformanceFromLine(self.freeTextBody.splitlines()[0])
 
     def saveResults(self, tmpFile, destFile):
-        # Here we save the average of the old and new performance, assuming fluctuation
-        avgPerformance = self.perfComparison.getAverage()
+        newStats = getBenchmarkStatistics(tmpFile)
+        if newStats:
+            # Benchmark statistics are kept, so the next benchmark run can compare with them.
+            # Save their median so the figure agrees with them
+            avgPerformance = newStats["median"]
+        else:
+            # Here we save the average of the old and new performance, assuming fluctuation
+            avgPerformance = self.perfComparison.getAverage()
         self.diag.info("Found average performance = " + str(avgPerformance) +
                        ", new performance = " + str(self.perfComparison.newPerformance))
-        line = open(tmpFile).readlines()[0]
-        lineToWrite = line.replace(str(self.perfComparison.newPerformance), str(avgPerformance))
+        lines = open(tmpFile).readlines()
+        lineToWrite = self.replacePerformance(lines[0], avgPerformance)
         newFile = open(destFile, "w")
         newFile.write(lineToWrite)
+        newFile.writelines((line for line in lines[1:] if line.startswith("Benchmark")))
+
+    def replacePerformance(self, line, performance):
+        # Replace the number where getPerformanceFromLine finds it
+        pos = line.find(":") + 1
+        oldText = line[pos:].lstrip().split()[0]
+        return line[:pos] + line[pos:].replace(oldText, str(performance), 1)
 
 # class purely for comparing two performance numbers, independent of the files they come from
 
@@ -272,6 +403,77 @@ class PerformanceComparison:
         return round((self.oldPerformance + self.newPerformance) / 2.0, 2)
 
 
+# Compares the medians of two benchmark runs, where the change also has to stand out from
+# the spread of the repeated measurements to count as significant
+
+
+class BenchmarkPerformanceComparison(PerformanceComparison):
+    def __init__(self, oldStats, newStats, settings):
+        self.oldStats = oldStats
+        self.newStats = newStats
+        PerformanceComparison.__init__(self, oldStats["median"], newStats["median"], settings)
+
+    def getNoise(self):
+        return 2 * math.sqrt(self.oldStats["stddev"] ** 2 + self.newStats["stddev"] ** 2)
+
+    def isSignificant(self, settings):
+        return PerformanceComparison.isSignificant(self, settings) and \
+            abs(self.newPerformance - self.oldPerformance) > self.getNoise()
+
+    def getSummary(self, includeNumbers=True):
+        summary = PerformanceComparison.getSummary(self, includeNumbers)
+        if summary and includeNumbers:
+            return summary + " (median of " + str(self.newStats["runs"]) + " runs)"
+        else:
+            return summary
+
+
+# Compares the new number against the recent history rather than a single old value, to avoid
+# flagging the normal noise on shared machines. Uses the median and median absolute deviation,
+# so the odd outlier in the history doesn't affect the result.
+
+
+class HistoricalPerformanceComparison(PerformanceComparison):
+    minimumSamples = 5
+
+    def __init__(self, oldPerf, newPerf, settings, samples):
+        self.median = plugins.median(samples)
+        # Scale MAD to be comparable with a standard deviation. Don't let it reach zero
+        # when the history is identical, or every tiny change would be infinitely significant
+        deviation = 1.4826 * plugins.median([abs(sample - self.median) for sample in samples])
+        self.deviation = max(deviation, abs(self.median) * 0.01, 0.01)
+        self.score = (newPerf - self.median) / self.deviation
+        self.confidence = math.erf(abs(self.score) / math.sqrt(2))
+        PerformanceComparison.__init__(self, oldPerf, newPerf, settings)
+
+    def calculatePercentageChange(self, settings):
+        if settings.flagSet("use_normalised_percentage_change"):
+            return plugins.calculatePercentageNormalised(self.median, self.newPerformance)
+        else:
+            return plugins.calculatePercentageStandard(self.median, self.newPerformance)
+
+    def getDescriptor(self, settings):
+        if self.newPerformance < self.median:
+            return settings.getDescriptor("performance_descriptor_decrease")
+        else:
+            return settings.getDescriptor("performance_descriptor_increase")
+
+    def getSummary(self, includeNumbers=True):
+        summary = PerformanceComparison.getSummary(self, includeNumbers)
+        if summary and includeNumbers and self.newPerformance >= 0:
+            return summary + " (" + str(int(self.confidence * 100)) + "% confidence)"
+        else:
+            return summary
+
+    def isSignificant(self, settings):
+        if settings.ignoreImprovements() and self.newPerformance < self.median:
+            return False
+
+        longEnough = settings.aboveMinimum(self.newPerformance, "performance_test_minimum") or \
+            settings.aboveMinimum(self.median, "performance_test_minimum")
+        return longEnough and abs(self.score) >= settings.getHistoryThreshold()
+
+
 class TimeFilter(plugins.Filter):
     option = "r"
 
@@ -316,40 +518,32 @@ class TimeFilter(plugins.Filter):
 
 
 class TimeGroupFilter(plugins.Filter):
+    reverseSort = False
+
     def __init__(self, testCount, *args):
         self.testCount = testCount
 
-    def makePerformanceDictionary(self, tests):
-        return {test: getTestPerformance(test) for test in tests}
-
     def refine(self, tests):
         if self.testCount <= 0 or self.testCount >= len(tests):
             return tests
-        testPerfDict = self.makePerformanceDictionary(tests)
-        sortedTestPerfDict = sorted(testPerfDict, key=cmp_to_key(lambda test1, test2: self.comparePerformance(testPerfDict[test1], testPerfDict[test2])))
-        return sortedTestPerfDict[:self.testCount]
-    
-    def comparePerformance(self, perf1, perf2):
-        return 0
+        testPerfDict = getTestPerformances(tests)
+        sortedTests = sorted(tests, key=testPerfDict.get, reverse=self.reverseSort)
+        return sortedTests[:self.testCount]
 
 
 class FastestFilter(TimeGroupFilter):
     option = "fastest"
 
-    def comparePerformance(self, perf1, perf2):
-        return perf1-perf2
-
 
 class SlowestFilter(TimeGroupFilter):
     option = "slowest"
-
-    def comparePerformance(self, perf1, perf2):
-        return perf2-perf1
+    reverseSort = True
 
 
 class PerformanceStatistics(plugins.ScriptWithArgs):
     scriptDoc = "Prints a report on system resource usage per test. Can compare versions"
     printedTitle = False
+    parallelSafe = True
 
     def __init__(self, args=[]):
         optDict = self.parseArguments(args, ["compv", "file"])
@@ -381,14 +575,24 @@ class PerformanceStatistics(plugins.ScriptWithArgs):
             line += entry.rjust(20)
         return line
 
-    def __call__(self, test):
+    def processTest(self, test):
+        perf = self.getPerformance(test)
+        if self.compareVersion is not None:
+            return perf, self.getPerformance(test, self.compareVersion)
+        else:
+            return perf, None
+
+    def getPerformance(self, test, version=None):
+        fileName = test.getFileName(self.file, version)
+        return PerformanceIndex.getInstance(test.app).getPerformance(fileName) if fileName else float(-1)
+
+    def reportTest(self, test, result):
+        perf, comparePerf = result
         self.testCount += 1
-        perf = getPerformance(test.getFileName(self.file))
         if perf > 0:
             self.total += perf
         entries = [test.getIndent() + test.name, self.format(perf)]
         if self.compareVersion is not None:
-            comparePerf = getPerformance(test.getFileName(self.file, self.compareVersion))
             self.compareTotal += comparePerf
             self.settings = PerformanceConfigSettings(test, self.file)
             perfComp = PerformanceComparison(comparePerf, perf, self.settings)
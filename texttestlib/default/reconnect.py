@@ -5,9 +5,13 @@ import operator
 import logging
 import time
 import datetime
+import json
+import io
 from texttestlib import plugins
 from glob import glob
 from itertools import groupby
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 # Trawl around for a suitable dir to reconnect to if we haven't been told one
 # A tangle of side-effects: we find the run directory when asked for the extra versions,
@@ -245,21 +249,87 @@ class ReconnectConfig:
             app.addConfigEntry("unsaveable_version", datedVersion)
 
 
+class ReconnectIndex:
+    """ Written into each application's write directory when a run completes: the tests that saved their
+    state, with the files written in each test's directory. Reconnecting can then use this instead of
+    looking in every test directory. Runs that didn't complete have no index, and are searched as before """
+    fileName = "reconnect_index.json"
+    indices = OrderedDict()
+
+    def __init__(self):
+        self.testFiles = {}
+
+    @classmethod
+    def recordTest(cls, test):
+        # The directory reconnection finds: the run directory's subdirectory for this application and version
+        appWriteDir = os.path.join(test.app.writeDirectory, test.app.name + test.app.versionSuffix())
+        index = cls.indices.setdefault(appWriteDir, cls())
+        index.addTest(test)
+
+    @classmethod
+    def writeAll(cls):
+        for appWriteDir, index in cls.indices.items():
+            index.write(appWriteDir)
+        cls.indices.clear()
+
+    @classmethod
+    def read(cls, appWriteDir):
+        fileName = os.path.join(appWriteDir, cls.fileName)
+        diag = logging.getLogger("Reconnection")
+        try:
+            with open(fileName) as f:
+                testFiles = json.load(f)["tests"]
+            diag.info("Using reconnection index at " + fileName + " with " + str(len(testFiles)) + " tests")
+            return testFiles
+        except (EnvironmentError, ValueError, KeyError):
+            diag.info("No reconnection index found at " + fileName)
+
+    def addTest(self, test):
+        try:
+            with os.scandir(test.getDirectory(temporary=1)) as entries:
+                self.testFiles[test.getRelPath()] = sorted(entry.name for entry in entries if entry.is_file())
+        except OSError:
+            pass  # No write directory, perhaps it was never run
+
+    def write(self, appWriteDir):
+        if not os.path.isdir(appWriteDir):
+            return
+        fileName = os.path.join(appWriteDir, self.fileName)
+        try:
+            with open(fileName + ".tmp", "w") as f:
+                json.dump({"tests": self.testFiles}, f)
+            os.replace(fileName + ".tmp", fileName)
+        except EnvironmentError:
+            plugins.printWarning("Could not write reconnection index at " + fileName)
+
+
 class ReconnectFilter(plugins.TextFilter):
     def __init__(self, rootDir):
         self.rootDir = rootDir
+        self.indexedPaths = set()
+        for relPath in ReconnectIndex.read(rootDir) or []:
+            while relPath and relPath not in self.indexedPaths:
+                self.indexedPaths.add(relPath)
+                relPath = os.path.dirname(relPath)
 
     def acceptsTestCase(self, test):
-        return os.path.exists(os.path.join(self.rootDir, test.getRelPath()))
+        return self.acceptsPath(test.getRelPath())
 
     def acceptsTestSuite(self, suite):
-        return os.path.exists(os.path.join(self.rootDir, suite.getRelPath()))
+        return self.acceptsPath(suite.getRelPath())
+
+    def acceptsPath(self, relPath):
+        return relPath in self.indexedPaths or os.path.exists(os.path.join(self.rootDir, relPath))
 
 
 class ReconnectTest(plugins.Action):
+    stateReadThreads = 8
+
     def __init__(self, rootDirToCopy, fullRecalculate):
         self.rootDirToCopy = rootDirToCopy
         self.fullRecalculate = fullRecalculate
+        self.testFiles = ReconnectIndex.read(rootDirToCopy) or {}
+        self.stateData = {}
         self.diag = logging.getLogger("Reconnection")
 
     def __repr__(self):
@@ -274,7 +344,7 @@ class ReconnectTest(plugins.Action):
     def getReconnectState(self, test):
         reconnLocation = os.path.join(self.rootDirToCopy, test.getRelPath())
         self.diag.info("Reconnecting to test at " + reconnLocation)
-        if os.path.isdir(reconnLocation):
+        if test.getRelPath() in self.testFiles or os.path.isdir(reconnLocation):
             return self.getReconnectStateFrom(test, reconnLocation)
         else:
             return plugins.Unrunnable(briefText="no results",
@@ -289,9 +359,11 @@ class ReconnectTest(plugins.Action):
     def getReconnectStateFrom(self, test, location, copyEvenIfLoadFails=True):
         stateToUse = None
         stateFile = os.path.join(location, "framework_tmp", "teststate")
-        if os.path.isfile(stateFile):
+        stateData = self.stateData.pop(stateFile, None)
+        stateData = stateData.get() if stateData else self.readStateData(stateFile)
+        if stateData is not None:
             newTmpPath = os.path.dirname(self.rootDirToCopy)
-            loaded, newState = test.getNewState(open(stateFile, "rb"), updatePaths=True, newTmpPath=newTmpPath)
+            loaded, newState = test.getNewState(io.BytesIO(stateData), updatePaths=True, newTmpPath=newTmpPath)
             self.diag.info("Loaded state file at " + stateFile + " - " + repr(loaded))
             if loaded and self.modifyState(test, newState):  # if we can't read it, recompute it
                 stateToUse = newState
@@ -301,17 +373,28 @@ class ReconnectTest(plugins.Action):
 
         return stateToUse
 
+    @staticmethod
+    def readStateData(stateFile):
+        try:
+            with open(stateFile, "rb") as f:
+                return f.read()
+        except EnvironmentError:
+            pass
+
     def copyFiles(self, test, reconnLocation):
         test.makeWriteDirectory()
         tmpDir = test.getDirectory(temporary=1)
         plugins.ensureDirectoryExists(tmpDir)
         self.diag.info("Copying files from " + reconnLocation + " to " + tmpDir)
-        for file in os.listdir(reconnLocation):
+        fileNames = self.testFiles.get(test.getRelPath())
+        if fileNames is None:
+            fileNames = [f for f in os.listdir(reconnLocation) if os.path.isfile(os.path.join(reconnLocation, f))]
+        for file in fileNames:
             fullPath = os.path.join(reconnLocation, file)
-            if os.path.isfile(fullPath):
+            if os.path.exists(fullPath):
                 targetPath = os.path.join(tmpDir, os.path.basename(fullPath))
                 try:
-                    shutil.copyfile(fullPath, targetPath)
+                    self.linkOrCopy(fullPath, targetPath)
                 except EnvironmentError as e:
                     # File could not be copied, may not have been readable
                     # Write the exception to it instead
@@ -319,6 +402,14 @@ class ReconnectTest(plugins.Action):
                     targetFile.write("Failed to copy file - exception info follows :\n" + str(e) + "\n")
                     targetFile.close()
 
+    def linkOrCopy(self, fullPath, targetPath):
+        # These files are only ever read, replaced or removed in the new run, never changed in place,
+        # so a hard link is as good as a copy
+        try:
+            os.link(fullPath, targetPath)
+        except OSError:
+            shutil.copyfile(fullPath, targetPath)
+
     def modifyState(self, test, newState):
         if self.fullRecalculate:
             # Only pick up errors here, recalculate the rest. Don't notify until
@@ -335,6 +426,16 @@ class ReconnectTest(plugins.Action):
 
     def setUpApplication(self, app):
         plugins.log.info("Reconnecting to test results in directory " + self.rootDirToCopy)
+        if self.testFiles:
+            self.readStatesInBackground()
+
+    def readStatesInBackground(self):
+        # Start reading all the state files, so they're ready by the time each test asks for its one
+        pool = ThreadPool(self.stateReadThreads)
+        for relPath in self.testFiles:
+            stateFile = os.path.join(self.rootDirToCopy, relPath, "framework_tmp", "teststate")
+            self.stateData[stateFile] = pool.apply_async(self.readStateData, (stateFile,))
+        pool.close()
 
     def setUpSuite(self, suite):
         self.describe(suite)
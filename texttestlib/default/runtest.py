@@ -9,9 +9,10 @@ import signal
 import pipes
 from texttestlib import plugins
 from texttestlib.jobprocess import killProcessAndChildren
-from time import sleep
+from time import sleep, time
 from threading import Lock, Timer
 from locale import getpreferredencoding
+from collections import OrderedDict
 
 plugins.addCategory("killed", "killed", "were terminated before completion")
 
@@ -41,9 +42,33 @@ class Killed(plugins.TestState):
         self.failedPrediction = self
 
 
-class RunTest(plugins.Action):
+class ProcessResourceUsage:
+    """ Resource usage of the SUT process tree, as reported by wait4 when the process is reaped.
+    Written in the same 'name value' form as 'time -p', with some extra entries. """
     def __init__(self):
+        self.entries = OrderedDict((name, 0) for name in ["real", "user", "sys", "maxrss", "inblock", "oublock", "nvcsw", "nivcsw"])
+
+    def add(self, rusage, realTime):
+        self.entries["real"] += realTime
+        self.entries["user"] += rusage.ru_utime
+        self.entries["sys"] += rusage.ru_stime
+        # Linux reports kilobytes, MacOS bytes. Processes run one after the other, so take the largest
+        maxRss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+        self.entries["maxrss"] = max(self.entries["maxrss"], maxRss)
+        for name in ["inblock", "oublock", "nvcsw", "nivcsw"]:
+            self.entries[name] += getattr(rusage, "ru_" + name)
+
+    def write(self, fileName):
+        with open(fileName, "w") as f:
+            for name, value in self.entries.items():
+                f.write(name + " " + str(round(value, 3)) + "\n")
+
+
+class RunTest(plugins.Action):
+    def __init__(self, benchmarkRuns=1, benchmarkWarmUpRuns=0):
         self.diag = logging.getLogger("run test")
+        self.benchmarkRuns = benchmarkRuns
+        self.benchmarkWarmUpRuns = benchmarkWarmUpRuns
         self.killDiag = logging.getLogger("kill processes")
         self.currentProcess = None
         self.currentTimer = None
@@ -96,6 +121,20 @@ class RunTest(plugins.Action):
         self.describe(test)
         machine = test.app.getRunMachine()
         killTimeout = test.getConfigValue("kill_timeout")
+        benchmarking = self.benchmarkRuns > 1 or self.benchmarkWarmUpRuns > 0
+        for runNumber in range(self.benchmarkWarmUpRuns + self.benchmarkRuns):
+            usage = ProcessResourceUsage() if self.collectsResourceUsage(test) else None
+            self.runTestProcesses(test, machine, killTimeout, usage, runNumber)
+            if self.killSignal is not None or test in self.killedTests:
+                break  # Don't start any more runs
+            measuredRun = runNumber + 1 - self.benchmarkWarmUpRuns
+            if benchmarking and measuredRun > 0:
+                self.diag.info("Completed benchmark run " + str(measuredRun) + " of " + repr(test))
+                self.storeBenchmarkRun(test, usage, measuredRun)
+            elif usage is not None:
+                usage.write(test.makeTmpFileName("rusage", forFramework=1))
+
+    def runTestProcesses(self, test, machine, killTimeout, usage, runNumber):
         for postfix in self.getTestRunPostfixes(test):
             if postfix:
                 # Checks for support processes like virtual displays, restarts if needed
@@ -103,21 +142,45 @@ class RunTest(plugins.Action):
 
             process = self.getTestProcess(test, machine, postfix)
             self.registerProcess(test, process)
-            if not postfix:
+            if not postfix and runNumber == 0:
                 # Don't claim to be running until we are, i.e. the process has started
                 self.changeToRunningState(test)
 
             if killTimeout and not test.app.isRecording() and not test.app.isActionReplay():
                 self.runMultiTimer(killTimeout, self.kill, (test, "timeout"))
-                self.wait(process)
+                self.wait(process, usage)
                 self.currentTimer.cancel()
                 self.currentTimer = None
             else:
-                self.wait(process)
+                self.wait(process, usage)
             self.checkAndClear(test, postfix)
             if self.killSignal is not None:
                 break  # Don't start other processes
 
+    def storeBenchmarkRun(self, test, usage, measuredRun):
+        # Keep each run's figures separately, MakePerformanceFile aggregates them
+        if usage is not None:
+            usage.write(test.makeTmpFileName("rusage_" + str(measuredRun), forFramework=1))
+        else:
+            perfFile = test.makeTmpFileName("unixperf", forFramework=1)
+            machine, remoteTmp = test.app.getRemoteTestTmpDir(test)
+            if remoteTmp:
+                # The remote sandbox is only copied back after the last run, and the next run overwrites it
+                remotePerfFile = os.path.join(remoteTmp, "framework_tmp", "unixperf")
+                if test.app.copyFileRemotely(remotePerfFile, machine, perfFile + "_" + str(measuredRun), "localhost"):
+                    plugins.printWarning("Could not fetch performance figures for benchmark run " + str(measuredRun) +
+                                         " of " + repr(test) + " from " + machine)
+            elif os.path.isfile(perfFile):
+                os.rename(perfFile, perfFile + "_" + str(measuredRun))
+
+    def collectsResourceUsage(self, test):
+        # We can only ask the OS about our own child processes: remote runs still use 'time'
+        return os.name == "posix" and test.app.getRunMachine() == "localhost" and \
+            (self.measuresCputime(test) or test.getConfigValue("collect_process_memory"))
+
+    def measuresCputime(self, test):
+        return test.app.hasAutomaticCputimeChecking() and test.app.executingOnPerformanceMachine(test)
+
     def getTestRunPostfixes(self, test):
         postfixes = [""]
         for postfix in test.getConfigValue("extra_test_process_postfix"):
@@ -213,12 +276,26 @@ class RunTest(plugins.Action):
         remoteScript = os.path.join(tmpDir, "kill_test.sh")
         test.app.runCommandOn(machine, ["sh", plugins.quote(remoteScript)])
 
-    def wait(self, process):
+    def wait(self, process, usage=None):
         try:
-            plugins.retryOnInterrupt(process.wait)
+            if usage is not None:
+                self.waitWithResourceUsage(process, usage)
+            else:
+                plugins.retryOnInterrupt(process.wait)
         except OSError:  # pragma: no cover - workaround for Python bugs only
             pass  # safest, as there are python bugs in this area
 
+    def waitWithResourceUsage(self, process, usage):
+        startTime = time()
+        try:
+            _, status, rusage = plugins.retryOnInterrupt(os.wait4, process.pid, 0)
+        except ChildProcessError:  # pragma: no cover - someone else reaped it, no usage available
+            plugins.retryOnInterrupt(process.wait)
+            return
+        # Same as os.waitstatus_to_exitcode, which needs Python 3.9
+        process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+        usage.add(rusage, time() - startTime)
+
     def getRunDescription(self, test):
         commandArgs = self.getLocalExecuteCmdArgs(test, makeDirs=False)
         text = "Command Line   : " + plugins.commandLineString(commandArgs) + "\n"
@@ -386,7 +463,7 @@ class RunTest(plugins.Action):
 
     def getLocalExecuteCmdArgs(self, test, postfix="", makeDirs=True, forLinux=False):
         args = []
-        if test.app.hasAutomaticCputimeChecking() and test.app.executingOnPerformanceMachine(test):
+        if self.measuresCputime(test) and not self.collectsResourceUsage(test):
             args += self.getTimingArgs(test, makeDirs)
 
         # Don't expand environment if we're running on a different file system
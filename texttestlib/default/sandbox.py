@@ -1080,25 +1080,54 @@ class UNIXPerformanceInfoFinder:
         self.diag = diag
         self.includeSystemTime = 0
 
-    def findTimesUsedBy(self, test):
-        # Read the UNIX performance file, allowing us to discount system time.
-        tmpFile = test.makeTmpFileName("unixperf", forFramework=1)
-        self.diag.info("Reading performance file " + tmpFile)
-        if not os.path.isfile(tmpFile):
-            return None, None
+    def findPerformanceFile(self, test):
+        # Prefer the resource usage written directly by RunTest, fall back to GNU time output (remote runs)
+        for stem in ["rusage", "unixperf"]:
+            tmpFile = test.makeTmpFileName(stem, forFramework=1)
+            if os.path.isfile(tmpFile):
+                return tmpFile
+
+    def findBenchmarkRunEntries(self, test):
+        # Benchmark runs store each run separately, numbered from 1
+        allEntries = []
+        for stem in ["rusage", "unixperf"]:
+            runNumber = 1
+            while True:
+                tmpFile = test.makeTmpFileName(stem + "_" + str(runNumber), forFramework=1)
+                if not os.path.isfile(tmpFile):
+                    break
+                allEntries.append(self.readUsageEntries(tmpFile))
+                runNumber += 1
+        return allEntries
+
+    def findUsageEntries(self, test):
+        tmpFile = self.findPerformanceFile(test)
+        if tmpFile is None:
+            return {}
+        else:
+            return self.readUsageEntries(tmpFile)
 
-        file = open(tmpFile)
-        cpuTime = None
-        realTime = None
-        for line in file.readlines():
+    def readUsageEntries(self, tmpFile):
+        entries = {}
+        self.diag.info("Reading performance file " + tmpFile)
+        for line in open(tmpFile).readlines():
             self.diag.info("Parsing line " + line.strip())
-            if line.startswith("user") or line.startswith("User"):
-                cpuTime = self.parseUnixTime(line)
-            if self.includeSystemTime and (line.startswith("sys") or line.startswith("Sys")):
-                cpuTime = cpuTime + self.parseUnixTime(line)
-            if line.startswith("real") or line.startswith("Real"):
-                realTime = self.parseUnixTime(line)
-        return cpuTime, realTime
+            words = line.strip().split()
+            if len(words) > 1:
+                try:
+                    entries[words[0].lower()] = self.parseUnixTime(line)
+                except ValueError:
+                    pass  # e.g. GNU time's "Command exited with non-zero status" lines
+        return entries
+
+    def findTimesUsedBy(self, test, entries=None):
+        # Read the UNIX performance file, allowing us to discount system time.
+        if entries is None:
+            entries = self.findUsageEntries(test)
+        cpuTime = entries.get("user")
+        if cpuTime is not None and self.includeSystemTime:
+            cpuTime += entries.get("sys", 0.0)
+        return cpuTime, entries.get("real")
 
     def parseUnixTime(self, line):
         # Assumes output of GNU time
@@ -1122,26 +1151,77 @@ class MakePerformanceFile(PerformanceFileCreator):
         self.systemPerfInfoFinder.setUpApplication(app)
 
     def makePerformanceFiles(self, test):
-        cpuTime, realTime = self.systemPerfInfoFinder.findTimesUsedBy(test)
+        runEntries = self.systemPerfInfoFinder.findBenchmarkRunEntries(test)
+        if runEntries:
+            return self.makeBenchmarkFiles(test, runEntries)
+
+        entries = self.systemPerfInfoFinder.findUsageEntries(test)
+        cpuTime, realTime = self.systemPerfInfoFinder.findTimesUsedBy(test, entries)
         # There was still an error (jobs killed in emergency), so don't write performance files
         if cpuTime is None:
             return
 
-        fileToWrite = test.makeTmpFileName("performance")
-        self.writeFile(test, cpuTime, realTime, fileToWrite)
+        if test.app.hasAutomaticCputimeChecking() and self.allMachinesTestPerformance(test, "cputime"):
+            fileToWrite = test.makeTmpFileName("performance")
+            self.writeFile(test, cpuTime, realTime, fileToWrite, entries)
+        if "maxrss" in entries and test.getConfigValue("collect_process_memory") and \
+                self.allMachinesTestPerformance(test, "memory"):
+            self.writeMemoryFile(test, entries["maxrss"], test.makeTmpFileName("memory"))
+
+    def makeBenchmarkFiles(self, test, runEntries):
+        # Use the median as the main figure, it's what gets compared with and saved
+        cpuTimes, realTimes = [], []
+        for entries in runEntries:
+            cpuTime, realTime = self.systemPerfInfoFinder.findTimesUsedBy(test, entries)
+            if cpuTime is not None:
+                cpuTimes.append(cpuTime)
+            if realTime is not None:
+                realTimes.append(realTime)
+        if test.app.hasAutomaticCputimeChecking() and self.allMachinesTestPerformance(test, "cputime") and cpuTimes:
+            realTime = plugins.median(realTimes) if realTimes else None
+            fileToWrite = test.makeTmpFileName("performance")
+            self.writeFile(test, plugins.median(cpuTimes), realTime, fileToWrite,
+                           benchmarkLine=self.makeBenchmarkLine(cpuTimes, " sec."))
+        maxRssValues = [entries["maxrss"] / 1024.0 for entries in runEntries if "maxrss" in entries]
+        if maxRssValues and test.getConfigValue("collect_process_memory") and \
+                self.allMachinesTestPerformance(test, "memory"):
+            self.writeMemoryFile(test, plugins.median(maxRssValues) * 1024, test.makeTmpFileName("memory"),
+                                 benchmarkLine=self.makeBenchmarkLine(maxRssValues, " MB"))
+
+    def makeBenchmarkLine(self, values, unit):
+        return "Benchmark  : " + str(len(values)) + " runs, min " + str(round(min(values), 2)) + \
+            ", median " + str(round(plugins.median(values), 2)) + \
+            ", stddev " + str(round(plugins.standardDeviation(values), 2)) + unit + "\n"
 
     def timeString(self, timeVal):
         return str(round(float(timeVal), 1)).rjust(9)
 
-    def writeFile(self, test, cpuTime, realTime, fileName):
+    def writeFile(self, test, cpuTime, realTime, fileName, entries=None, benchmarkLine=""):
+        entries = entries or {}
         file = open(fileName, "w")
         cpuLine = "CPU time   : " + self.timeString(cpuTime) + " sec. " + test.state.hostString() + "\n"
         file.write(cpuLine)
+        file.write(benchmarkLine)
         if realTime is not None:
             realLine = "Real time  : " + self.timeString(realTime) + " sec.\n"
             file.write(realLine)
+        if "inblock" in entries:
+            # Blocks are 512 bytes
+            ioLine = "I/O        : " + str(int(entries["inblock"] / 2)).rjust(9) + " KB read, " + \
+                str(int(entries["oublock"] / 2)) + " KB written\n"
+            file.write(ioLine)
+        if "nvcsw" in entries:
+            switchLine = "Context sw.: " + str(int(entries["nvcsw"])).rjust(9) + " voluntary, " + \
+                str(int(entries["nivcsw"])) + " involuntary\n"
+            file.write(switchLine)
         file.write(self.machineInfoFinder.getMachineInformation(test))
 
+    def writeMemoryFile(self, test, maxRss, fileName, benchmarkLine=""):
+        # maxrss is in kB, always report MB
+        with open(fileName, "w") as file:
+            file.write("Max Memory :      " + str(round(maxRss / 1024.0, 2)) + " MB\n")
+            file.write(benchmarkLine)
+
 # Relies on the config entry performance_logfile_extractor, so looks in the log file for anything reported
 # by the program
 
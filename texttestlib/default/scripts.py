@@ -287,6 +287,7 @@ class DocumentScripts(plugins.Action):
 
 class ReplaceText(plugins.ScriptWithArgs):
     scriptDoc = "Perform a search and replace on all files with the given stem"
+    parallelSafe = True
 
     def __init__(self, args):
         argDict = self.parseArguments(args, ["old", "new", "file", "regexp", "argsReplacement", "includeShortcuts"])
@@ -314,19 +315,33 @@ class ReplaceText(plugins.ScriptWithArgs):
         else:
             return test.getFileNamesMatching(stem)
 
-    def __call__(self, test):
-        self.replaceInFiles(test)
-
-    def replaceInFiles(self, test):
-        replaced = False
+    def processTest(self, test):
+        replacements = []
         for stem in self.stems:
             for stdFile in self.getFilesToChange(test, stem):
                 if os.path.isfile(stdFile) and not plugins.containsAutoGeneratedText(stdFile):
-                    self.replaceInFile(test, stdFile)
-                    replaced = True
-        return replaced
+                    replacements.append((stdFile, self.getReplacedText(stdFile)))
+        return replacements
 
-    def replaceInFile(self, test, stdFile):
+    def reportTest(self, test, replacements):
+        for stdFile, newText in replacements:
+            self.replaceInFile(test, stdFile, newText)
+
+    def replaceInFiles(self, test):
+        replacements = self.processTest(test)
+        self.reportTest(test, replacements)
+        return len(replacements) > 0
+
+    def getReplacedText(self, stdFile):
+        newLines = []
+        with open(stdFile) as readFile:
+            for line in readFile:
+                newLines.append(self.trigger.replace(line, self.newMultiLineText if not self.argsReplacement else self.replaceArgs))
+            if self.oldText[-1] != "\n" and not self.argsReplacement:
+                newLines.append(self.trigger.getLeftoverText())
+        return "".join(newLines)
+
+    def replaceInFile(self, test, stdFile, newText):
         fileName = os.path.basename(stdFile)
         self.describe(test, " - file " + fileName)
         sys.stdout.flush()
@@ -335,12 +350,7 @@ class ReplaceText(plugins.ScriptWithArgs):
             unversionedFileName += "." + test.app.name
         tmpFile = os.path.join(test.getDirectory(temporary=1), unversionedFileName)
         with open(tmpFile, "w") as writeFile:
-            with open(stdFile) as readFile:
-                for line in readFile:
-                    newLine = self.trigger.replace(line, self.newMultiLineText if not self.argsReplacement else self.replaceArgs)
-                    writeFile.write(newLine)
-                if self.oldText[-1] != "\n" and not self.argsReplacement:
-                    writeFile.write(self.trigger.getLeftoverText())
+            writeFile.write(newText)
 
     def replaceArgs(self, matchobj):
         from storytext.replayer import ReplayScript
@@ -3,10 +3,14 @@ import os
 import shutil
 import subprocess
 import sys
+import hashlib
+import tempfile
 from texttestlib import plugins
 from locale import getpreferredencoding
 
 class SetUpCaptureMockHandlers(plugins.Action):
+    sharedInterceptDirs = {}
+
     def __init__(self, recordSetting):
         self.recordSetting = recordSetting
         libexecDir = plugins.installationDir("libexec")
@@ -34,14 +38,54 @@ class SetUpCaptureMockHandlers(plugins.Action):
         if rcFiles:
             captureMockActive = self.setUpCaptureMock(test, interceptDir, rcFiles)
 
-        if pythonCustomizeFiles:
-            self.intercept(pythonCustomizeFiles[-1], interceptDir)  # most specific
-
         useSiteCustomize = captureMockActive or pythonCoverage or pythonCustomizeFiles
         if useSiteCustomize:
-            self.intercept(self.siteCustomizeFile, interceptDir)
+            moduleFiles = [self.siteCustomizeFile] + pythonCustomizeFiles[-1:]  # most specific
+            pythonDirs = [self.getPythonInterceptDir(test, moduleFiles, interceptDir)]
+            if pythonDirs[0] != interceptDir and os.path.isdir(interceptDir):
+                pythonDirs.append(interceptDir)  # whatever CaptureMock has set up for this test
             for var in ["PYTHONPATH", "JYTHONPATH"]:
-                test.setEnvironment(var, interceptDir + os.pathsep + test.getEnvironment(var, ""))
+                test.setEnvironment(var, os.pathsep.join(pythonDirs + [test.getEnvironment(var, "")]))
+
+    def getPythonInterceptDir(self, test, moduleFiles, interceptDir):
+        if test.app.getRemoteTestTmpDir(test)[1]:
+            # Remote sandboxes only get the test's own directory, so it has to have its own copy
+            for moduleFile in moduleFiles:
+                self.intercept(moduleFile, interceptDir)
+            return interceptDir
+
+        # Tests with the same modules to intercept can all use the same directory: only create it once
+        key = test.app.localWriteDirectory, tuple(moduleFiles)
+        sharedDir = self.sharedInterceptDirs.get(key)
+        if sharedDir is None:
+            digest = self.getContentDigest(moduleFiles)
+            # Keep the name "traffic_intercepts", sitecustomize.py relies on it
+            sharedDir = os.path.join(test.app.localWriteDirectory, "traffic_intercepts", digest, "traffic_intercepts")
+            if not os.path.isdir(sharedDir):
+                self.makeSharedInterceptDir(moduleFiles, sharedDir)
+            self.sharedInterceptDirs[key] = sharedDir
+        return sharedDir
+
+    def getContentDigest(self, moduleFiles):
+        md5 = hashlib.md5()
+        for moduleFile in moduleFiles:
+            md5.update(moduleFile.encode())
+            with open(moduleFile, "rb") as f:
+                md5.update(f.read())
+        return md5.hexdigest()
+
+    def makeSharedInterceptDir(self, moduleFiles, sharedDir):
+        # Build it elsewhere and rename, so other processes never see it half-written
+        parentDir = os.path.dirname(sharedDir)
+        plugins.ensureDirectoryExists(parentDir)
+        tmpDir = tempfile.mkdtemp(dir=parentDir)
+        for moduleFile in moduleFiles:
+            self.copyOrLink(moduleFile, os.path.join(tmpDir, os.path.basename(moduleFile)))
+        try:
+            os.rename(tmpDir, sharedDir)
+        except OSError:
+            # Some other process got there first
+            shutil.rmtree(tmpDir, ignore_errors=True)
 
     def setUpCaptureMock(self, test, interceptDir, rcFiles):
         extReplayFile = test.getFileName("traffic")
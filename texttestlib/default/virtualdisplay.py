@@ -5,10 +5,13 @@ import sys
 import subprocess
 import signal
 import logging
+from threading import Thread, Lock, Condition
 from texttestlib import plugins
 
 # Unlike earlier incarnations of this functionality,
 # we don't rely on sharing displays but create our own for each test run.
+# Each display is watched by a thread waiting for its Xvfb process, so one that terminates is replaced
+# straight away, from a pool of spare displays if we're keeping any.
 
 
 class VirtualDisplayResponder(plugins.Responder):
@@ -17,7 +20,13 @@ class VirtualDisplayResponder(plugins.Responder):
     def __init__(self, *args):
         plugins.Responder.__init__(self, *args)
         self.displayInfoList = []
+        self.spareDisplays = []
         self.guiSuites = []
+        self.lock = Lock()
+        self.replacementCondition = Condition(self.lock)
+        self.displaysReplacing = []
+        self.displaysReplaced = False
+        self.closing = False
         self.diag = logging.getLogger("virtual display")
         self.killDiag = logging.getLogger("kill processes")
         VirtualDisplayResponder.instance = self
@@ -31,7 +40,9 @@ class VirtualDisplayResponder(plugins.Responder):
 
     def getVariablesToSet(self):
         vars = []
-        for i, (_, displayName, _, _, _, _) in enumerate(self.displayInfoList):
+        with self.lock:
+            displayInfoList = list(self.displayInfoList)
+        for i, (_, displayName, _, _, _, _) in enumerate(displayInfoList):
             suffix = "" if i == 0 else str(i + 1)
             vars.append(("DISPLAY" + suffix, displayName))
         return vars
@@ -39,6 +50,7 @@ class VirtualDisplayResponder(plugins.Responder):
     def setUpVirtualDisplay(self, guiSuites):
         if len(guiSuites) == 0:
             return
+        self.closing = False
         machines = self.findMachines(guiSuites)
         displayCount = max((suite.getConfigValue("virtual_display_count") for suite in guiSuites))
         for _ in range(displayCount):
@@ -46,9 +58,82 @@ class VirtualDisplayResponder(plugins.Responder):
             if displayInfo:
                 self.displayInfoList.append(displayInfo)
                 self.guiSuites = guiSuites
+                self.startMonitoring(displayInfo)
             elif len(machines) > 0:
                 plugins.printWarning("Failed to start virtual display on " +
                                      ",".join(machines) + " - using real display.")
+        if self.displayInfoList:
+            spareCount = max((suite.getConfigValue("virtual_display_spare_count") for suite in guiSuites))
+            for _ in range(spareCount):
+                Thread(target=self.addSpareDisplay, daemon=True).start()
+
+    def startNewDisplay(self):
+        return self.getDisplayInfo(self.findMachines(self.guiSuites), self.guiSuites[0].app)
+
+    def addSpareDisplay(self):
+        displayInfo = self.startNewDisplay()
+        if displayInfo:
+            with self.lock:
+                if not self.closing:
+                    self.diag.info("Started spare virtual display " + displayInfo[1])
+                    self.spareDisplays.append(displayInfo)
+                    return
+            self.killDisplay(displayInfo)
+
+    def takeSpareDisplay(self):
+        while True:
+            with self.lock:
+                if not self.spareDisplays:
+                    return
+                displayInfo = self.spareDisplays.pop(0)
+            if displayInfo[3].poll() is None:
+                return displayInfo
+            self.killDisplay(displayInfo)  # Spare has died too. Don't leave its window manager or zombies around
+
+    def startMonitoring(self, displayInfo):
+        if displayInfo[3] is not None:
+            Thread(target=self.monitorDisplay, args=(displayInfo,), daemon=True).start()
+
+    def monitorDisplay(self, displayInfo):
+        # The Xvfb wrapper, or the ssh process running it remotely, exits exactly when the display does
+        self.waitForExit(displayInfo[3])
+        self.replaceDisplay(displayInfo)
+
+    def waitForExit(self, proc):
+        # Don't reap the process if we can avoid it: poll() from the main thread doesn't work while we're in wait()
+        if hasattr(os, "waitid"):
+            try:
+                os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            except ChildProcessError:
+                pass  # already reaped elsewhere
+        else:  # pragma: no cover - all UNIX platforms we know of have waitid
+            proc.wait()
+
+    def replaceDisplay(self, displayInfo):
+        with self.lock:
+            if self.closing or displayInfo not in self.displayInfoList or displayInfo in self.displaysReplacing:
+                return
+            self.displaysReplacing.append(displayInfo)
+        self.diag.info("Virtual display " + displayInfo[1] + " has terminated, replacing it")
+        self.killDisplay(displayInfo)
+        newDisplayInfo = self.takeSpareDisplay()
+        usedSpare = newDisplayInfo is not None
+        if not usedSpare:
+            newDisplayInfo = self.startNewDisplay()
+        with self.lock:
+            replaced = newDisplayInfo is not None and not self.closing
+            if replaced:
+                self.displayInfoList[self.displayInfoList.index(displayInfo)] = newDisplayInfo
+                self.displaysReplaced = True
+            # If we couldn't replace it, the dead display stays in the list, and we try again after the next test
+            self.displaysReplacing.remove(displayInfo)
+            self.replacementCondition.notify_all()
+        if replaced:
+            self.startMonitoring(newDisplayInfo)
+            if usedSpare:
+                Thread(target=self.addSpareDisplay, daemon=True).start()
+        elif newDisplayInfo:
+            self.killDisplay(newDisplayInfo)
 
     def getDisplayInfo(self, machines, app):
         for machine in machines:
@@ -69,31 +154,35 @@ class VirtualDisplayResponder(plugins.Responder):
         return allMachines
 
     def notifyTestProcessComplete(self, test):
-        if self.restartXvfbAndWm():
+        if self.takeReplacedDisplays():
             plugins.log.info("Virtual display had terminated unexpectedly with some test processes still to run.")
             for var, value in self.getVariablesToSet():
                 plugins.log.info("Reset " + var + " variable to " + value + " for test " + repr(test))
                 test.setEnvironment(var, value)
 
     def notifyComplete(self, *args):
-        if self.restartXvfbAndWm():
+        if self.takeReplacedDisplays():
             plugins.log.info("Virtual display had terminated unexpectedly.")
             for var, value in self.getVariablesToSet():
                 plugins.log.info("Reset " + var + " variable to " + value + ".")
 
-    def restartXvfbAndWm(self):
-        # Whenever a test completes, we check to see if the virtual server is still going
-        changed = False
-        for i, displayInfo in enumerate(self.displayInfoList):
-            xvfbOrSshProc = displayInfo[3]
-            if xvfbOrSshProc is not None and xvfbOrSshProc.poll() is not None:
-                xvfbOrSshProc.wait()  # Don't leave zombie processes around
-                # If Xvfb has terminated, we need to restart it
-                newDisplayInfo = self.getDisplayInfo(self.findMachines(self.guiSuites), self.guiSuites[0].app)
-                if newDisplayInfo:
-                    self.displayInfoList[i] = newDisplayInfo
-                    changed = True
-        return changed
+    def takeReplacedDisplays(self):
+        # The monitor threads may not have noticed yet, or may have failed to start a replacement:
+        # check for ourselves, so the next test process gets a working display
+        with self.lock:
+            deadDisplays = [d for d in self.displayInfoList if d[3] is not None and d[3].poll() is not None]
+        for displayInfo in deadDisplays:
+            self.replaceDisplay(displayInfo)
+        with self.replacementCondition:
+            self.replacementCondition.wait_for(lambda: len(self.displaysReplacing) == 0)
+            replaced = self.displaysReplaced
+            self.displaysReplaced = False
+        if replaced:
+            # Later tests get their display from the suite environment
+            for suite in self.guiSuites:
+                for var, value in self.getVariablesToSet():
+                    suite.setEnvironment(var, value)
+        return replaced
 
     def notifyAllComplete(self):
         self.cleanXvfbAndWm()
@@ -105,14 +194,19 @@ class VirtualDisplayResponder(plugins.Responder):
             pass
 
     def cleanXvfbAndWm(self):
-        if len(self.displayInfoList) and os.name == "posix":
-            wmExecutable = self.guiSuites[0].app.getConfigValue("virtual_display_wm_executable")
-            for displayInfo in self.displayInfoList:
-                machine, _, xvfbPid, xvfbOrSshProc, wmPid, wmOrSshProc = displayInfo
-                if wmExecutable:
-                    self.killProcess("window manager", machine, wmPid, wmOrSshProc)
-                self.killProcess("Xvfb", machine, xvfbPid, xvfbOrSshProc)
-            self.displayInfoList = []
+        with self.lock:
+            self.closing = True
+            displayInfoList = self.displayInfoList + self.spareDisplays
+            self.displayInfoList, self.spareDisplays = [], []
+        if len(displayInfoList) and os.name == "posix":
+            for displayInfo in displayInfoList:
+                self.killDisplay(displayInfo)
+
+    def killDisplay(self, displayInfo):
+        machine, _, xvfbPid, xvfbOrSshProc, wmPid, wmOrSshProc = displayInfo
+        if wmOrSshProc is not None:
+            self.killProcess("window manager", machine, wmPid, wmOrSshProc)
+        self.killProcess("Xvfb", machine, xvfbPid, xvfbOrSshProc)
 
     def killProcess(self, procName, machine, pid, localProc):
         if machine == "localhost":
@@ -9,6 +9,7 @@ import time
 import re
 import stat
 import shlex
+import statistics
 import types
 import fnmatch
 import subprocess
@@ -534,6 +535,26 @@ class Action:
 
 
 class ScriptWithArgs(Action):
+    # Scripts setting this do their per-test work in processTest, which must not write anything or
+    # change the script's state, so it can be run in other processes. reportTest is then still called
+    # in this process, in test order, with what processTest returned
+    parallelSafe = False
+    # The action runner gives each script instance its own dictionary when it runs processTest in advance
+    precomputedResults = None
+
+    def __call__(self, test):
+        if self.precomputedResults and test in self.precomputedResults:
+            result = self.precomputedResults.pop(test)
+        else:
+            result = self.processTest(test)
+        self.reportTest(test, result)
+
+    def processTest(self, test):
+        pass
+
+    def reportTest(self, test, result):
+        pass
+
     @classmethod
     def parseArguments(cls, args, allowedArgs):
         currKey = ""
@@ -1321,6 +1342,14 @@ def calculatePercentageStandard(oldVal, newVal):
         return zeroDivisorPercentage(newVal)
 
 
+def median(values):
+    return statistics.median(values)
+
+
+def standardDeviation(values):
+    return statistics.stdev(values) if len(values) > 1 else 0.0
+
+
 def roundPercentage(val):
     perc = int(round(val))
     if perc == 0:
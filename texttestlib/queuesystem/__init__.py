@@ -268,7 +268,7 @@ class QueueSystemConfig(default.Config):
 
     def getSlaveSwitches(self):
         return ["c", "b", "trace", "ignorecat", "ignorefilters", "delay", "screenshot", "gui", "td",
-                "rectraffic", "keeptmp", "keepslave", "reconnect", "reconnfull", "rerun"]
+                "rectraffic", "keeptmp", "keepslave", "reconnect", "reconnfull", "rerun", "bench", "benchwarmup"]
 
     def getExecHostFinder(self):
         if self.slaveRun():
@@ -335,7 +335,7 @@ class QueueSystemConfig(default.Config):
 
     def getTestRunner(self):
         if self.slaveRun():
-            return slavejobs.RunTestInSlave()
+            return slavejobs.RunTestInSlave(*self.getBenchmarkCounts())
         else:
             return default.Config.getTestRunner(self)
 
@@ -7,6 +7,8 @@ from texttestlib import plugins
 
 
 class QueueSystem(object):
+    killedJobPattern = None  # regular expression finding job IDs in the output of killing several at once
+
     def __init__(self, *args):
         pass
 
@@ -28,6 +30,19 @@ class QueueSystem(object):
     def supportsPolling(self):
         return True
 
+    def killJobs(self, jobIds):
+        # Queue systems that can delete several jobs with one command do so, rather than one command per job
+        if len(jobIds) < 2 or self.killedJobPattern is None:
+            return {jobId: self.killJob(jobId) for jobId in jobIds}
+        output = self.runKillCommand(jobIds)
+        killedIds = set((match.group(1) for match in self.killedJobPattern.finditer(output)))
+        return {jobId: jobId in killedIds for jobId in jobIds}
+
+    def runKillCommand(self, jobIds):
+        proc = subprocess.Popen(self.getKillCmdArgs(jobIds), stdin=open(os.devnull), stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, encoding=getpreferredencoding())
+        return proc.communicate()[0]
+
     def findErrorMessage(self, stderr, *args):
         if len(stderr) > 0:
             basicError = self.findSubmitError(stderr)
@@ -1,5 +1,6 @@
 
 import os
+import re
 import subprocess
 from . import abstractqueuesystem
 from texttestlib.plugins import log
@@ -16,6 +17,8 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
                    "5": ("HELD", "Being held"),
                    "6": ("TRANS", "Transfering output")}
     submitProg = "condor_submit"
+    # Older versions say "Cluster N has been marked...", newer ones "All jobs in cluster N have been marked..."
+    killedJobPattern = re.compile("[Cc]luster ([0-9]+) ha(?:s|ve) been marked for removal")
 
     def getSubmitCmdArgs(self, submissionRules, commandArgs=[], slaveEnv={}):
         return commandArgs  # These really aren't very interesting, as all the stuff is in the command file
@@ -73,6 +76,9 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
         killProcess.wait()
         return killProcess.returncode == 0
 
+    def getKillCmdArgs(self, jobIds):
+        return ["condor_rm"] + jobIds
+
     def getJobId(self, line):
         word = line.split()[5]
         return word[:-1]
@@ -6,26 +6,108 @@ import errno
 import time
 import os
 import sys
+import hashlib
+import subprocess
+import tempfile
 from texttestlib import plugins
 from texttestlib.utils import getPortListenErrorCode, getUserName
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from queue import Queue
 from fnmatch import fnmatch
+from locale import getpreferredencoding
+
+
+class SynchManifest:
+    """ Digests of what's in the directories we copy to the instances, from the names, sizes and modification times
+    of their files. A marker file named after the digest is left beside each directory on an instance once it's copied,
+    so later runs, including those by other machines in this run, can see with one command what's already up to date """
+    markerPrefix = ".texttest_synch_"
+
+    def __init__(self, synchDirs):
+        self.synchDirs = synchDirs
+        self.digests = {}
+        self.lock = Lock()
+        self.excludeDirs, self.excludeFiles = self.readExcludePatterns()
+
+    @staticmethod
+    def readExcludePatterns():
+        # Same patterns rsync is told to ignore by default, so changes to these don't cause copying
+        excludeDirs, excludeFiles = [], []
+        excludeFile = plugins.installationPath("etc", "rsync_exclude_patterns")
+        if excludeFile:
+            with open(excludeFile) as f:
+                for line in f:
+                    pattern = line.strip()
+                    if pattern.endswith("/"):
+                        excludeDirs.append(pattern[:-1])
+                    elif pattern:
+                        excludeFiles.append(pattern)
+        return excludeDirs, excludeFiles
+
+    @staticmethod
+    def isExcluded(name, patterns):
+        return any((fnmatch(name, pattern) for pattern in patterns))
+
+    def getDigest(self, path):
+        with self.lock:
+            if path not in self.digests:
+                self.digests[path] = self.computeDigest(path)
+            return self.digests[path]
+
+    def computeDigest(self, path):
+        # rsync copies what links point at (--copy-unsafe-links), so follow them here too,
+        # or changes reached through a link would leave the digest the same
+        md5 = hashlib.md5()
+        if os.path.isfile(path):
+            self.addToDigest(md5, path, os.path.basename(path))
+        visitedDirs = set()
+        for root, dirs, files in os.walk(path, followlinks=True):
+            realRoot = os.path.realpath(root)
+            if realRoot in visitedDirs:  # link cycle, or the same directory linked twice
+                dirs[:] = []
+                continue
+            visitedDirs.add(realRoot)
+            dirs[:] = sorted((d for d in dirs if not self.isExcluded(d, self.excludeDirs)))
+            for fileName in sorted(files):
+                if not self.isExcluded(fileName, self.excludeFiles):
+                    fullPath = os.path.join(root, fileName)
+                    self.addToDigest(md5, fullPath, os.path.relpath(fullPath, path))
+        return md5.hexdigest()
+
+    @staticmethod
+    def addToDigest(md5, fullPath, relPath):
+        try:
+            stat = os.stat(fullPath)
+            linkTarget = os.readlink(fullPath) if os.path.islink(fullPath) else ""
+        except OSError:
+            return
+        line = relPath + "\0" + linkTarget + "\0" + str(stat.st_size) + "\0" + str(stat.st_mtime_ns) + "\n"
+        md5.update(line.encode("utf-8", "surrogateescape"))
+
+    def getMarkerStem(self, path):
+        return os.path.join(os.path.dirname(path), self.markerPrefix + os.path.basename(path) + "_")
+
+    def getMarker(self, path):
+        return self.getMarkerStem(path) + self.getDigest(path)
 
 
 class Ec2Machine:
     instanceTypeInfo = {"8xlarge": 32, "4xlarge": 16, "2xlarge": 8, "xlarge": 4, "large": 2, "medium": 1}
+    # All ssh commands to a machine share one connection, so only the first one pays for the handshake
+    sshControlOptions = ["-o", "ControlMaster=auto", "-o", "ControlPersist=60",
+                         "-o", "ControlPath=" + os.path.join(tempfile.gettempdir(), "texttest-ssh-%C")]
 
-    def __init__(self, inst, synchDirs, app, subprocessLock, alreadyRunning):
+    def __init__(self, inst, synchManifest, app, subprocessLock, alreadyRunning):
         self.id = inst.id
         self.ip = inst.private_ip_address
         self.fullMachine = "ec2-user@" + self.ip
         self.cores = self.instanceTypeInfo.get(inst.instance_type.split(".")[-1], 1)
-        self.synchDirs = synchDirs
+        self.synchManifest = synchManifest
+        self.synchDirs = synchManifest.synchDirs
         self.synchProc = None
         self.app = app
         self.remoteProcessInfo = {}
-        self.remoteProcessInfoLock = Lock()
+        self.remoteProcessInfoCondition = Condition()
         self.thread = Thread(target=self.runThread)
         self.thread.setName("Machine_" + self.ip)
         self.startWaitCounter = 0
@@ -52,8 +134,18 @@ class Ec2Machine:
     def hasJob(self, jobId):
         return jobId in self.remoteProcessInfo
 
+    def getCommandArgs(self, cmdArgs, **kw):
+        args = self.app.getCommandArgsOn(self.fullMachine, cmdArgs, **kw)
+        if args[0] == "ssh":
+            args[1:1] = self.sshControlOptions
+        return args
+
+    def runCommand(self, cmdArgs):
+        return subprocess.call(self.getCommandArgs(cmdArgs), stdin=open(os.devnull),
+                               stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+
     def setLocalProcessId(self, jobId, localPid):
-        with self.remoteProcessInfoLock:
+        with self.remoteProcessInfoCondition:
             remotePid = None
             if jobId in self.remoteProcessInfo:
                 _, remotePid = self.remoteProcessInfo[jobId]
@@ -61,29 +153,47 @@ class Ec2Machine:
         self.diag.info("Job ID " + jobId + " now got local PID " + localPid)
 
     def setRemoteProcessId(self, jobId, remotePid):
-        with self.remoteProcessInfoLock:
+        with self.remoteProcessInfoCondition:
             localPid, _ = self.remoteProcessInfo[jobId]
             self.remoteProcessInfo[jobId] = localPid, remotePid
+            self.remoteProcessInfoCondition.notify_all()
         self.diag.info("Job ID " + jobId + " now got remote PID " + remotePid)
 
     def synchronise(self):
         parents = self.getParents(self.synchDirs)
         self.app.ensureRemoteDirExists(self.fullMachine, *parents)
+        upToDate = self.findUpToDateDirs()
         for dir in self.synchDirs:
-            if not self.errorMessage:
-                self.synchronisePath(dir)
+            if dir in upToDate:
+                self.diag.info("Contents of " + dir + " already up to date on " + self.ip)
+            elif not self.errorMessage and self.synchronisePath(dir):
+                self.writeSynchMarker(dir)
+
+    def findUpToDateDirs(self):
+        markers = {self.synchManifest.getMarker(dir): dir for dir in self.synchDirs}
+        cmdArgs = self.getCommandArgs(["ls", "-d"] + list(map(plugins.quote, markers)))
+        # ls exits with an error if some are missing, but still lists those that exist
+        proc = subprocess.Popen(cmdArgs, stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=open(os.devnull, "w"))
+        output = str(proc.communicate()[0], getpreferredencoding())
+        return [markers[line] for line in output.splitlines() if line in markers]
+
+    def writeSynchMarker(self, path):
+        # Remove markers for earlier contents, which aren't true any more
+        stem = self.synchManifest.getMarkerStem(path)
+        marker = self.synchManifest.getMarker(path)
+        self.runCommand(["rm", "-f", plugins.quote(stem) + "*", "&&", "touch", plugins.quote(marker)])
 
     def synchronisePath(self, path):
         dirName = os.path.dirname(path)
         for _ in range(5):
-            with self.subprocessLock:
-                self.synchProc = self.app.getRemoteCopyFileProcess(path, "localhost", dirName, self.fullMachine)
+            self.synchProc = self.app.getRemoteCopyFileProcess(path, "localhost", dirName, self.fullMachine)
             errorCode = self.synchProc.wait()
             if errorCode == 0:
                 self.synchProc = None
-                return
+                return True
             else:
                 time.sleep(1)
+        return False
 
     def waitForStart(self):
         timeout = 1000
@@ -163,7 +273,7 @@ class Ec2Machine:
 
             self.thread.start()
         argsWithEnv = self.getCommandArgsWithEnvironment(cmdArgs, slaveEnv)
-        remoteCmdArgs = self.app.getCommandArgsOn(self.fullMachine, argsWithEnv, agentForwarding=True)
+        remoteCmdArgs = self.getCommandArgs(argsWithEnv, agentForwarding=True)
         self.queue.put((jobId, plugins.Callable(submitter, remoteCmdArgs, slaveEnv, *args)))
         return jobId
 
@@ -180,18 +290,16 @@ class Ec2Machine:
         localPid, remotePid = self.waitForRemoteProcessId(jobId)
         if remotePid:
             cmdArgs = ["python", "-c", "\"import os; os.kill(" + remotePid + ", " + str(sig) + ")\""]
-            self.app.runCommandOn(self.fullMachine, cmdArgs)
+            self.runCommand(cmdArgs)
             return True, localPid
         else:
             return False, localPid
 
     def waitForRemoteProcessId(self, jobId):
-        for _ in range(10):
-            localPid, remotePid = self.remoteProcessInfo[jobId]
-            if remotePid:
-                return localPid, remotePid
-            # Remote process exists but has not yet told us its process ID. Wait a bit and try again.
-            time.sleep(1)
+        # Remote process may exist but not yet have told us its process ID. Wait until it does.
+        with self.remoteProcessInfoCondition:
+            if self.remoteProcessInfoCondition.wait_for(lambda: self.remoteProcessInfo[jobId][1], timeout=10):
+                return self.remoteProcessInfo[jobId]
         return None, None
 
     def collectJobStatus(self, jobStatus, procStatus):
@@ -213,8 +321,8 @@ class QueueSystem(local.QueueSystem):
         self.app = app
         self.subprocessLock = Lock()
         instances, runningIds = self.findInstances()
-        synchDirs = self.getDirectoriesForSynch()
-        self.machines = [Ec2Machine(inst, synchDirs, app, self.subprocessLock,
+        synchManifest = SynchManifest(self.getDirectoriesForSynch())
+        self.machines = [Ec2Machine(inst, synchManifest, app, self.subprocessLock,
                                     inst.id in runningIds) for inst in instances]
         self.releasedMachines = []
         self.capacity = self.calculateCapacity()
@@ -9,10 +9,14 @@ class QueueSystem(abstractqueuesystem.QueueSystem):
         if shutil.which(self.submitProg) is None:
             raise plugins.TextTestError("Cannot submit TextTest tests to grid engine: '" + self.submitProg + "' not installed!")
         self.coreFileLocation = self.getCoreFileLocation(app)
+        self.submittedJobIds = set()
 
     def submitSlaveJob(self, cmdArgs, slaveEnv, logDir, *args, **kw):
         # Don't use log dir as working directory, it might not exist yet
-        return abstractqueuesystem.QueueSystem.submitSlaveJob(self, cmdArgs, slaveEnv, self.coreFileLocation, *args, **kw)
+        jobId, errorMessage = abstractqueuesystem.QueueSystem.submitSlaveJob(self, cmdArgs, slaveEnv, self.coreFileLocation, *args, **kw)
+        if jobId:
+            self.submittedJobIds.add(jobId)
+        return jobId, errorMessage
 
     def getCoreFileLocation(self, app):
         location = app.getConfigValue("queue_system_core_file_location")
@@ -1,5 +1,6 @@
 
 import os
+import re
 from . import gridqueuesystem
 
 # Used by the master to submit, monitor and delete jobs...
@@ -7,6 +8,8 @@ from . import gridqueuesystem
 
 class QueueSystem(gridqueuesystem.QueueSystem):
     submitProg = "bsub"
+    killedJobPattern = re.compile("Job <([0-9]+)> is being (?:terminated|signaled)")
+
     def getSubmitCmdArgs(self, submissionRules, commandArgs=[], slaveEnv={}):
         bsubArgs = ["bsub", "-J", submissionRules.getJobName()]
         if submissionRules.processesNeeded != 1:
@@ -66,6 +69,9 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         resultOutput = os.popen("bkill -s USR1 " + jobId + " 2>&1").read()
         return resultOutput.find("is being terminated") != -1 or resultOutput.find("is being signaled") != -1
 
+    def getKillCmdArgs(self, jobIds):
+        return ["bkill", "-s", "USR1"] + jobIds
+
     def getJobId(self, line):
         word = line.split()[1]
         return word[1:-1]
@@ -59,6 +59,7 @@ class QueueSystemServer(BaseActionRunner):
         self.jobs = OrderedDict()
         self.submissionRules = {}
         self.killedJobs = {}
+        self.batchKilledJobs = {}
         self.queueSystems = {}
         self.reusedTests = {}
         self.reuseOnly = False
@@ -140,7 +141,11 @@ class QueueSystemServer(BaseActionRunner):
             self.addTestToQueues(test)
         self.delayedTestsForAdd = []
 
+    def getScheduleCapacity(self):
+        return self.maxCapacity
+
     def notifyAllRead(self, suites):
+        self.addScheduledTests()
         self.addDelayedTests()
         BaseActionRunner.notifyAllRead(self, suites)
         self.allRead = True
@@ -625,8 +630,10 @@ class QueueSystemServer(BaseActionRunner):
             return prevJobExisted
 
         self.describeJob(test, jobId, jobName)
-        queueSystem = self.getQueueSystem(test)
-        jobExisted = queueSystem.killJob(jobId)
+        if jobId in self.batchKilledJobs:
+            jobExisted = self.batchKilledJobs.pop(jobId)
+        else:
+            jobExisted = self.getQueueSystem(test).killJob(jobId)
         self.killedJobs[jobId] = test, jobExisted
         return jobExisted
 
@@ -653,6 +660,7 @@ class QueueSystemServer(BaseActionRunner):
         # If we've been killed with some sort of limit signal, wait here until we know
         # all tests terminate. Otherwise we rely on them terminating naturally, and if they don't
         wantStatus = self.killSignal and self.killSignal not in [signal.SIGINT, signal.SIGTERM]
+        self.killJobsTogether()
         killedTests = []
         for test, jobList in list(self.jobs.items()):
             if not test.state.isComplete():
@@ -662,6 +670,21 @@ class QueueSystemServer(BaseActionRunner):
         if wantStatus:
             self.waitForKill(killedTests)
 
+    def killJobsTogether(self):
+        # Delete all the jobs with as few queue system commands as possible, killTest then picks up the results
+        jobIdsBySystem = OrderedDict()
+        for test, jobList in list(self.jobs.items()):
+            if not test.state.isComplete():
+                queueSystem = self.getQueueSystem(test)
+                if queueSystem is None:
+                    continue
+                jobIds = jobIdsBySystem.setdefault(queueSystem, [])
+                for jobId, _ in jobList:
+                    if jobId not in self.killedJobs and jobId not in jobIds:
+                        jobIds.append(jobId)
+        for queueSystem, jobIds in jobIdsBySystem.items():
+            self.batchKilledJobs.update(queueSystem.killJobs(jobIds))
+
     def waitForKill(self, killedTests):
         # Wait for a minute for the kill to take effect, otherwise give up
         stillRunning = killedTests
@@ -1,5 +1,6 @@
 
 import os
+import re
 import string
 import subprocess
 from . import gridqueuesystem
@@ -32,6 +33,7 @@ class QueueSystem(gridqueuesystem.QueueSystem):
                    "T": ("THRESH", "Suspended by SGE as it exceeded allowed thresholds")}
     errorStatuses = ["Eqw", "ERq"]
     submitProg = "qsub"
+    killedJobPattern = re.compile("(?:has registered the job|has deleted job) ([0-9]+)")
     def __init__(self, *args):
         self.qdelOutput = ""
         self.errorReasons = {}
@@ -78,10 +80,16 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         return stderr.strip().splitlines()[0]
 
     def killJob(self, jobId):
-        proc = subprocess.Popen(["qdel", jobId], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding=getpreferredencoding())
-        self.qdelOutput = proc.communicate()[0]
+        self.runKillCommand([jobId])
         return self.qdelOutput.find("has registered the job") != -1 or self.qdelOutput.find("has deleted job") != -1
 
+    def getKillCmdArgs(self, jobIds):
+        return ["qdel"] + jobIds
+
+    def runKillCommand(self, jobIds):
+        self.qdelOutput = gridqueuesystem.QueueSystem.runKillCommand(self, jobIds)
+        return self.qdelOutput
+
     def setSuspendState(self, jobId, newState):
         arg = "-sj" if newState else "-usj"
         cmdArgs = ["qmod", arg, jobId]
@@ -104,22 +112,27 @@ class QueueSystem(gridqueuesystem.QueueSystem):
                 log.info("Unexpected output from qsub : " + line.strip())
         return jobId
 
+    def getStatusCmdArgs(self):
+        # Only ask about our own jobs, the whole grid may have many more
+        user = os.getenv("USER")
+        return ["qstat", "-u", user] if user else ["qstat"]
+
     def getStatusForAllJobs(self):
         statusDict = {}
-        proc = subprocess.Popen(["qstat"], stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding=getpreferredencoding())
+        proc = subprocess.Popen(self.getStatusCmdArgs(), stdin=open(os.devnull), stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding=getpreferredencoding())
         outMsg = proc.communicate()[0]
         if proc.returncode > 0:
             # SGE unavailable for the moment, don't update the job status
             return
 
+        errorJobIds = []
         for line in outMsg.splitlines():
             words = line.split()
-            if len(words) >= 5 and words[0].isdigit():
+            if len(words) >= 5 and words[0] in self.submittedJobIds:
                 jobId = words[0]
                 statusLetter = self.getStatusLetter(words, 4)
                 if statusLetter in self.errorStatuses:
-                    self.errorReasons[jobId] = self.getErrorReason(jobId)
-                    self.killJob(jobId)
+                    errorJobIds.append(jobId)
                     continue
 
                 status = self.allStatuses.get(statusLetter)
@@ -128,6 +141,9 @@ class QueueSystem(gridqueuesystem.QueueSystem):
                 else:
                     log.info("WARNING: unexpected job status " + repr(statusLetter) + " received from SGE!")
                     statusDict[jobId] = statusLetter, statusLetter
+        if errorJobIds:
+            self.errorReasons.update(self.getErrorReasons(errorJobIds))
+            self.killJobs(errorJobIds)
         return statusDict
 
     def isDate(self, text):
@@ -139,14 +155,18 @@ class QueueSystem(gridqueuesystem.QueueSystem):
         else:
             return self.getStatusLetter(words, statusIndex + 1)
 
-    def getErrorReason(self, jobId):
-        proc = subprocess.Popen(["qstat", "-j", jobId], stdin=open(os.devnull), encoding=getpreferredencoding(),
+    def getErrorReasons(self, jobIds):
+        proc = subprocess.Popen(["qstat", "-j", ",".join(jobIds)], stdin=open(os.devnull), encoding=getpreferredencoding(),
                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         outMsg = proc.communicate()[0]
+        reasons = dict.fromkeys(jobIds, "")
+        jobId = None
         for line in outMsg.splitlines():
-            if line.startswith("error reason"):
-                return line.strip()
-        return ""
+            if line.startswith("job_number:"):
+                jobId = line.split(":", 1)[1].strip()
+            elif line.startswith("error reason") and not reasons.get(jobId):
+                reasons[jobId] = line.strip()
+        return reasons
 
     def getSlaveStartErrorMessage(self):
         errFile = self.getSlaveStartErrorFile()
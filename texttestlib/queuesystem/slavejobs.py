@@ -182,6 +182,9 @@ class SlaveActionRunner(ActionRunner):
         if len(goodSuites) == 0:
             ActionRunner.notifyAllRead(self, goodSuites)
 
+    def schedulesByDuration(self, test):
+        return False  # the master decides the order, we run whatever we're given
+
     def notifyRerun(self, *args):
         pass  # don't rerun directly in the slave, tell the master and give it a chance to send the job elsewhere
 